@@ -18,8 +18,9 @@ def getRecipeRunsFromHistorian(start, end, tagPath):
         dataset: A dataset with processed shift recipe runs.
     """
     try:
-        queryStart = system.date.addHours(start, -1)
-        rawDataSet = system.tag.queryTagHistory(paths=[tagPath], startDate=queryStart, endDate=end, returnSize=-1, aggregationMode="Maximum", returnFormat='Wide')
+        queryStart = start
+        # The recipe active at shift start comes from the bounding value instead of an hour of padding
+        rawDataSet = PerformanceTracking.v4.historian.queryTagHistory(paths=[tagPath], startDate=queryStart, endDate=end, returnSize=-1, aggregationMode="Maximum", includeBoundingValues=True, returnFormat='Wide')
    
         uniqueDataSet = getUniqueRecipes(rawDataSet)
 
@@ -84,7 +85,7 @@ def compileShiftRecipeData(start, end, filteredDataSet):
             recipe, startTime, endTime = filteredDataSet.getValueAt(i, 0), filteredDataSet.getValueAt(i, 1), endTimes[i]
             if startTime < startStr <= endTime:
                 startTime = startStr
-            if startTime >= startStr:
+            if startStr <= startTime <= endStr:
                 duration = calculateMinutesBetweenTimes(startTime, endTime, dateFormat)
                 shiftData.append([recipe, startTime, endTime, duration])
     
@@ -122,7 +123,7 @@ def getRecipeInfoFromDB(machineName):
         queryParams = {"machineName": machineName}
     
         # Run the named query
-        result = system.db.runNamedQuery(queryPath, queryParams)
+        result = PerformanceTracking.v4.singleFlight.runNamedQuery(queryPath, queryParams)
     
         return result
     except Exception as e:
@@ -284,7 +285,7 @@ def getIdleTimeForRecipe(idlePath, startTime, endTime):
     """
     try:
         paths = [idlePath]
-        durationResult = system.tag.queryTagCalculations(paths, ["DurationOn"], startTime, endTime)
+        durationResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["DurationOn"], startTime, endTime)
         return int(durationResult.getValueAt(0, 1))
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
@@ -63,7 +63,7 @@ def countOn(tagPath, queryStart, queryEnd):
         start = queryStart
         end = queryEnd
         paths = [tagPath]
-        countResult = system.tag.queryTagCalculations(paths, ["CountOn"], start, end)
+        countResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["CountOn"], start, end)
         return int(countResult.getValueAt(0, 1))
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
@@ -82,7 +82,7 @@ def durationOn(tagPath, queryStart, queryEnd):
         start = queryStart
         end = queryEnd
         paths = [tagPath]
-        durationResult = system.tag.queryTagCalculations(paths, ["DurationOn"], start, end)
+        durationResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["DurationOn"], start, end)
         return durationResult.getValueAt(0, 1) if durationResult is not None else 0
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
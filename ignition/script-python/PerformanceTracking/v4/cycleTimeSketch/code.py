@@ -0,0 +1,308 @@
+import bisect
+import math
+import system
+from java.util.concurrent import ConcurrentHashMap
+from java.util.concurrent.locks import ReentrantLock
+
+# Sketches per machine and recipe, kept in the gateway globals across timer runs and shifts
+SKETCH_GLOBALS_KEY = 'PerformanceTracking.v4.cycleTimeSketches'
+
+# Log-spaced buckets: bucket i holds cycle times in [MIN_SECONDS * GROWTH^i, MIN_SECONDS * GROWTH^(i+1)),
+# so a quantile is off by at most half a bucket (about 5%). The first and last buckets also
+# take everything below and above the covered range (0.5 s to about 27 h).
+MIN_SECONDS = 0.5
+GROWTH = 1.1
+BUCKET_COUNT = 128
+
+# Down intervals between two Cycle Done edges include the load/unload time of every normal
+# cycle. Only a down interval longer than this many cycle targets stops the machine and
+# leaves the gap out; recipes without a cycle target use DEFAULT_MAX_DOWN_SECONDS.
+DOWN_TARGET_MULTIPLE = 3
+DEFAULT_MAX_DOWN_SECONDS = 600
+
+
+def newSketch():
+    """
+    Creates an empty cycle-time sketch: fixed bucket counts plus a running mean and
+    variance (Welford).
+
+    Returns:
+        dict: 'counts', 'count', 'mean', 'm2', 'min' and 'max', times in seconds.
+    """
+    return {'counts': [0] * BUCKET_COUNT, 'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+
+def bucketOf(seconds):
+    """
+    Returns the bucket holding a cycle time.
+    """
+    if seconds <= MIN_SECONDS:
+        return 0
+    return min(BUCKET_COUNT - 1, int(math.log(seconds / MIN_SECONDS) / math.log(GROWTH)))
+
+def add(sketch, seconds):
+    """
+    Adds one cycle time to a sketch.
+    """
+    sketch['counts'][bucketOf(seconds)] += 1
+    sketch['count'] += 1
+    delta = seconds - sketch['mean']
+    sketch['mean'] += delta / sketch['count']
+    sketch['m2'] += delta * (seconds - sketch['mean'])
+    sketch['min'] = seconds if sketch['min'] is None else min(sketch['min'], seconds)
+    sketch['max'] = seconds if sketch['max'] is None else max(sketch['max'], seconds)
+
+def merge(first, second):
+    """
+    Combines two sketches, such as the sketches of several shifts or machines.
+
+    Returns:
+        dict: A new sketch equal to one fed with the cycle times of both.
+    """
+    merged = newSketch()
+    merged['counts'] = [first['counts'][i] + second['counts'][i] for i in range(BUCKET_COUNT)]
+    merged['count'] = first['count'] + second['count']
+    if merged['count'] == 0:
+        return merged
+    delta = second['mean'] - first['mean']
+    merged['mean'] = first['mean'] + delta * second['count'] / merged['count']
+    merged['m2'] = first['m2'] + second['m2'] + delta * delta * first['count'] * second['count'] / merged['count']
+    merged['min'] = min(value for value in (first['min'], second['min']) if value is not None)
+    merged['max'] = max(value for value in (first['max'], second['max']) if value is not None)
+    return merged
+
+def quantile(sketch, q):
+    """
+    Estimates a quantile of the cycle times in a sketch.
+
+    Args:
+        sketch (dict): The sketch.
+        q (float): Quantile between 0 and 1, e.g. 0.95.
+    Returns:
+        float: Estimated cycle time in seconds, or None for an empty sketch.
+    """
+    if sketch['count'] == 0:
+        return None
+    rank = q * (sketch['count'] - 1)
+    seen = 0
+    for i in range(BUCKET_COUNT):
+        seen += sketch['counts'][i]
+        if seen > rank:
+            # Geometric middle of the bucket, kept within the observed range
+            estimate = MIN_SECONDS * GROWTH ** (i + 0.5)
+            return min(max(estimate, sketch['min']), sketch['max'])
+    return sketch['max']
+
+def standardDeviation(sketch):
+    """
+    Returns the sample standard deviation of the cycle times in a sketch, in seconds.
+    """
+    if sketch['count'] < 2:
+        return 0.0
+    return math.sqrt(sketch['m2'] / (sketch['count'] - 1))
+
+def getState():
+    """
+    Returns the gateway-wide sketch state, creating it on first use.
+
+    Returns:
+        dict: 'machines' (root tag path -> {'lastEdge', 'lastRecipe', 'shiftStart'}),
+            'sketches' ((root tag path, recipe, scope) -> sketch, scope being 'shift' or
+            'total') and 'lock'.
+    """
+    globalVars = system.util.getGlobals()
+    state = globalVars.get(SKETCH_GLOBALS_KEY)
+    if state is None:
+        state = globalVars.setdefault(SKETCH_GLOBALS_KEY, {'machines': ConcurrentHashMap(), 'sketches': ConcurrentHashMap(), 'lock': ReentrantLock()})
+    return state
+
+def mergeIntervals(intervals):
+    """
+    Merges (startMillis, endMillis) intervals into sorted, disjoint ones.
+
+    Returns:
+        tuple: (starts, ends) lists of the merged intervals.
+    """
+    starts, ends = [], []
+    for intervalStart, intervalEnd in sorted(intervals):
+        if ends and intervalStart <= ends[-1]:
+            ends[-1] = max(ends[-1], intervalEnd)
+        else:
+            starts.append(intervalStart)
+            ends.append(intervalEnd)
+    return starts, ends
+
+def overlaps(starts, ends, gapStart, gapEnd):
+    """
+    Tells whether (gapStart, gapEnd) overlaps one of the merged intervals.
+    """
+    i = bisect.bisect_right(ends, gapStart)
+    return i < len(starts) and starts[i] < gapEnd
+
+def longestOverlapping(starts, ends, gapStart, gapEnd):
+    """
+    Returns the length in milliseconds of the longest merged interval overlapping
+    (gapStart, gapEnd), or 0 when none does.
+    """
+    longest = 0
+    i = bisect.bisect_right(ends, gapStart)
+    while i < len(starts) and starts[i] < gapEnd:
+        longest = max(longest, ends[i] - starts[i])
+        i += 1
+    return longest
+
+def maxDownMillis(cycleTarget):
+    """
+    Returns the longest down interval a cycle may span, given its recipe's cycle target in minutes.
+    """
+    if not cycleTarget:
+        return DEFAULT_MAX_DOWN_SECONDS * 1000
+    return int(DOWN_TARGET_MULTIPLE * float(cycleTarget) * 60000)
+
+def observe(rootTagPath, edges, recipeRuns, shiftStart, idleIntervals=None, downIntervals=None):
+    """
+    Feeds the Cycle Done rising edges of a machine into its per-recipe sketches.
+    The time between two consecutive edges inside the same recipe run is one cycle,
+    unless the machine was idle or stopped in between: such a gap is not a cycle time and
+    is left out. Short down intervals are the load/unload time of the cycle itself, so
+    only down intervals longer than DOWN_TARGET_MULTIPLE cycle targets stop it. Edges at or before the last one already seen are skipped, so each cycle
+    can hand over every edge of the shift so far without counting any cycle twice. The
+    last edge is forgotten when the shift changes, so no cycle spans two shifts.
+
+    Args:
+        rootTagPath (str): Root tag path of the machine.
+        edges (list): Rising edge times in epoch milliseconds, in time order.
+        recipeRuns (list): (recipe, startMillis, endMillis, cycleTarget) runs in time order,
+            cycleTarget in minutes or None.
+        shiftStart (Date): Start of the current shift; the shift sketches restart with it.
+        idleIntervals (list, optional): (startMillis, endMillis) Machine Idle intervals that
+            no cycle may overlap.
+        downIntervals (list, optional): (startMillis, endMillis) downtime intervals.
+    """
+    try:
+        state = getState()
+        state['lock'].lock()
+        try:
+            machine = state['machines'].get(rootTagPath)
+            if machine is None:
+                machine = {'lastEdge': None, 'lastRecipe': None, 'shiftStart': None}
+                state['machines'].put(rootTagPath, machine)
+            if machine['shiftStart'] != shiftStart.getTime():
+                machine['shiftStart'] = shiftStart.getTime()
+                machine['lastEdge'] = None
+                machine['lastRecipe'] = None
+                for key in list(state['sketches'].keySet()):
+                    if key[0] == rootTagPath and key[2] == 'shift':
+                        state['sketches'].remove(key)
+
+            idleStarts, idleEnds = mergeIntervals(idleIntervals or [])
+            downStarts, downEnds = mergeIntervals(downIntervals or [])
+            run = 0
+            for millis in edges:
+                if machine['lastEdge'] is not None and millis <= machine['lastEdge']:
+                    continue
+                while run < len(recipeRuns) and recipeRuns[run][2] < millis:
+                    run += 1
+                recipe = recipeRuns[run][0] if run < len(recipeRuns) and recipeRuns[run][1] <= millis else None
+                isCycle = recipe is not None and recipe == machine['lastRecipe'] and machine['lastEdge'] is not None
+                if isCycle and overlaps(idleStarts, idleEnds, machine['lastEdge'], millis):
+                    isCycle = False
+                if isCycle and longestOverlapping(downStarts, downEnds, machine['lastEdge'], millis) > maxDownMillis(recipeRuns[run][3]):
+                    isCycle = False
+                if isCycle:
+                    seconds = (millis - machine['lastEdge']) / 1000.0
+                    for scope in ('shift', 'total'):
+                        key = (rootTagPath, recipe, scope)
+                        sketch = state['sketches'].get(key)
+                        if sketch is None:
+                            sketch = newSketch()
+                            state['sketches'].put(key, sketch)
+                        add(sketch, seconds)
+                machine['lastEdge'] = millis
+                machine['lastRecipe'] = recipe
+        finally:
+            state['lock'].unlock()
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in observe: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/cycleTimeSketch.observe', 'Error2': 'Error updating cycle time sketches', 'Error3': str(e)})
+
+def getSketch(rootTagPath, recipe, scope='shift'):
+    """
+    Returns a copy of the sketch of a machine and recipe, or an empty sketch.
+
+    Args:
+        rootTagPath (str): Root tag path of the machine.
+        recipe (str): Recipe name.
+        scope (str): 'shift' for the current shift, 'total' for every shift observed.
+    """
+    sketch = getState()['sketches'].get((rootTagPath, recipe, scope))
+    return merge(newSketch(), sketch) if sketch is not None else newSketch()
+
+def compareToTargets(systemName, machineName, scope='shift'):
+    """
+    Reports the actual cycle time distribution of every recipe of a machine against its
+    CycleTarget from scadaGetRecipeTable.
+
+    Args:
+        systemName (str): The name of the system.
+        machineName (str): The name of the machine.
+        scope (str): 'shift' or 'total'.
+    Returns:
+        list: One dict per recipe with 'RecipeName', 'CycleTarget', 'Cycles',
+            'MeanMinutes', 'StdDevMinutes', 'P50Minutes' and 'P95Minutes'.
+    """
+    try:
+        rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+        targets = PerformanceTracking.v4.getRecipeRunInfo.getRecipeInfoFromDB(machineName)
+        report = []
+        for row in range(targets.getRowCount()):
+            recipe = targets.getValueAt(row, "RecipeName")
+            sketch = getSketch(rootTagPath, recipe, scope)
+            p50, p95 = quantile(sketch, 0.5), quantile(sketch, 0.95)
+            report.append({
+                'RecipeName': recipe,
+                'CycleTarget': targets.getValueAt(row, "CycleTarget"),
+                'Cycles': sketch['count'],
+                'MeanMinutes': round(sketch['mean'] / 60.0, 3),
+                'StdDevMinutes': round(standardDeviation(sketch) / 60.0, 3),
+                'P50Minutes': round(p50 / 60.0, 3) if p50 is not None else None,
+                'P95Minutes': round(p95 / 60.0, 3) if p95 is not None else None
+            })
+        return report
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in compareToTargets: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/cycleTimeSketch.compareToTargets', 'Error2': 'Error comparing cycle times to targets', 'Error3': str(e)})
+
+def example():
+    """
+    Feeds a scratch machine ten back-to-back 60 s cycles, each ending with a 5 s down gap
+    for load/unload, followed by a 20 minute stop and two more cycles, and checks that
+    every cycle but the one spanning the stop is counted. Run from the script console.
+    """
+    rootTagPath = '[example]cycleTimeSketch/'
+    state = getState()
+    shiftStart = system.date.now()
+    start = shiftStart.getTime()
+    edges, downIntervals = [], []
+    millis = start
+    for cycle in range(10):
+        millis += 60000
+        edges.append(millis)
+        downIntervals.append((millis, millis + 5000))
+        millis += 5000
+    downIntervals[-1] = (millis - 5000, millis + 20 * 60000)
+    millis += 20 * 60000
+    for cycle in range(2):
+        millis += 65000
+        edges.append(millis)
+    recipeRuns = [('Example', start, millis, 1.0)]
+    try:
+        observe(rootTagPath, edges, recipeRuns, shiftStart, [], downIntervals)
+        sketch = getSketch(rootTagPath, 'Example')
+        print "Cycles: %d (expected 10), mean: %.1f s (expected 65.0)" % (sketch['count'], sketch['mean'])
+        return sketch['count'] == 10
+    finally:
+        state['machines'].remove(rootTagPath)
+        for scope in ('shift', 'total'):
+            state['sketches'].remove((rootTagPath, 'Example', scope))
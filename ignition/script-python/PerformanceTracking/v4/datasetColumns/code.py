@@ -0,0 +1,135 @@
+from com.inductiveautomation.ignition.common import BasicDataset
+from java.lang import Boolean, Class, Double, Integer, Long, Object, String
+from jarray import array
+import system
+
+# Type of the column-major data array of a BasicDataset
+OBJECT_ARRAY = Class.forName("[Ljava.lang.Object;")
+
+
+def unwrap(dataSet):
+    """
+    Returns the Dataset behind a PyDataSet, or the dataset itself.
+    """
+    if hasattr(dataSet, 'getUnderlyingDataset'):
+        return dataSet.getUnderlyingDataset()
+    return dataSet
+
+def columnIndex(dataSet, column):
+    """
+    Resolves a column name or index to an index. Raises ValueError for a column the
+    dataset does not have, as getValueAt(row, name) does, instead of wrapping around.
+    """
+    if isinstance(column, basestring):
+        index = dataSet.getColumnIndex(column)
+        if index < 0:
+            raise ValueError("Dataset has no column named '%s'" % column)
+        return index
+    if column < 0 or column >= dataSet.getColumnCount():
+        raise ValueError("Dataset has no column %d" % column)
+    return column
+
+def getColumnArray(dataSet, column):
+    """
+    Reads a whole column in one call.
+
+    Args:
+        dataSet (Dataset or PyDataSet): The dataset.
+        column (str or int): Column name or index.
+    Returns:
+        Object[] or list: For a BasicDataset, the column array backing the dataset, which
+            must not be modified; otherwise a list read cell by cell.
+    """
+    dataSet = unwrap(dataSet)
+    index = columnIndex(dataSet, column)
+    rowCount = dataSet.getRowCount()
+    if isinstance(dataSet, BasicDataset):
+        values = dataSet.getData()[index]
+        if len(values) == rowCount:
+            return values
+        return values[:rowCount]
+    return [dataSet.getValueAt(row, index) for row in range(rowCount)]
+
+def getColumn(dataSet, column):
+    """
+    Reads a whole column into a Python list.
+
+    Args:
+        dataSet (Dataset or PyDataSet): The dataset.
+        column (str or int): Column name or index.
+    Returns:
+        list: The column values, one per row.
+    """
+    return list(getColumnArray(dataSet, column))
+
+def columnType(values):
+    """
+    Java type of a computed column, from its first value that is not None.
+    """
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return Boolean
+        if isinstance(value, (int, long)):
+            return Integer if isinstance(value, int) else Long
+        if isinstance(value, float):
+            return Double
+        if isinstance(value, basestring):
+            return String
+        if isinstance(value, Object):
+            return value.getClass()
+        return Object
+    return Object
+
+def appendColumns(dataSet, columns):
+    """
+    Attaches computed columns to a dataset without copying its rows.
+    The result is a plain BasicDataset, so it can be stored in tags and sent to clients.
+    When the input is a BasicDataset its existing columns are shared, not copied; datasets
+    are not modified in place, so neither one sees changes through the other.
+
+    Args:
+        dataSet (Dataset or PyDataSet): The dataset.
+        columns (list): (column name, values) pairs, one value per row.
+    Returns:
+        Dataset: The dataset with the columns appended.
+    """
+    dataSet = unwrap(dataSet)
+    columnNames = list(dataSet.getColumnNames()) + [name for name, values in columns]
+    columnTypes = list(dataSet.getColumnTypes()) + [columnType(values) for name, values in columns]
+    data = [getColumnArray(dataSet, index) for index in range(dataSet.getColumnCount())]
+    data.extend(list(values) for name, values in columns)
+    data = [array(values, Object) if isinstance(values, list) else values for values in data]
+    return BasicDataset(columnNames, columnTypes, array(data, OBJECT_ARRAY))
+
+def zipColumns(dataSet, *columns):
+    """
+    Reads several columns and returns them row by row.
+
+    Args:
+        dataSet (Dataset or PyDataSet): The dataset.
+        columns (str or int): Column names or indexes. All columns when none are given.
+    Returns:
+        list: One tuple of the requested values per row.
+    """
+    if not columns:
+        columns = range(unwrap(dataSet).getColumnCount())
+    if not unwrap(dataSet).getRowCount():
+        return []
+    return zip(*[getColumnArray(dataSet, column) for column in columns])
+
+def columnSum(dataSet, column):
+    """
+    Sums a numeric column, skipping None values.
+    """
+    return sum(value for value in getColumnArray(dataSet, column) if value is not None)
+
+def columnMax(dataSet, column):
+    """
+    Returns the largest value of a column, skipping None values, or None when there are none.
+    """
+    values = [value for value in getColumnArray(dataSet, column) if value is not None]
+    if not values:
+        return None
+    return max(values)
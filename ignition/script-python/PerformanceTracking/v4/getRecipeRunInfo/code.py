@@ -4,35 +4,179 @@ import system
 from java.util import Calendar, Date
 from java.text import SimpleDateFormat
 from math import floor
-from system.dataset import toDataSet, addRow, toPyDataSet
+from system.dataset import toDataSet, toPyDataSet
 import json
 
-def getRecipeRunsFromHistorian(start, end, tagPath):
+
+class RecipeRunTable(object):
+    """
+    Columnar table of recipe runs used inside the getRecipeRunInfo pipeline. Each stage
+    fills its columns in place, and the table becomes an Ignition dataset once, with
+    toDataset, at the public boundary. Columns that were not filled are left out.
+    """
+    __slots__ = ('recipes', 'starts', 'ends', 'startMillis', 'endMillis', 'durations', 'setupTimes', 'cycleTargets', 'idleTimes', 'expectedParts', 'actualParts')
+
+    def __init__(self):
+        self.recipes = []
+        self.starts = []
+        self.ends = []
+        self.startMillis = []
+        self.endMillis = []
+        self.durations = []
+        self.setupTimes = None
+        self.cycleTargets = None
+        self.idleTimes = None
+        self.expectedParts = None
+        self.actualParts = None
+
+    def append(self, recipe, start, end, startMillis, endMillis):
+        self.recipes.append(recipe)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.startMillis.append(startMillis)
+        self.endMillis.append(endMillis)
+        self.durations.append(round((endMillis - startMillis) / 60000.0, 2))
+
+    def getRowCount(self):
+        return len(self.recipes)
+
+    def toDataset(self):
+        """
+        Builds the dataset of the filled columns, in the order the pipeline adds them.
+        """
+        headers = ["Recipe Name", "Start Time", "End Time", "Duration (Minutes)"]
+        columns = [self.recipes, self.starts, self.ends, self.durations]
+        for header, column in (("Setup Time", self.setupTimes), ("Cycle Target", self.cycleTargets), ("Idle Time (Minutes)", self.idleTimes), ("Expected Parts", self.expectedParts), ("Actual Parts", self.actualParts)):
+            if column is not None:
+                headers.append(header)
+                columns.append(column)
+        return toDataSet(headers, [list(row) for row in zip(*columns)] if self.recipes else [])
+
+
+def getRecipeHistoryForMachines(start, end, tagPaths):
+    """
+    Retrieves the Active Recipe history for many machines with a single Tall historian call.
+    Args:
+        start (Date): Shift start time.
+        end (Date): Shift end time.
+        tagPaths (list): Active Recipe tag paths, one per machine.
+    Returns:
+        dict: Tag path -> dataset shaped like a single path Wide query (t_stamp, value).
+    """
+    try:
+        # The bounding values give the recipe active at the start of every machine
+        return PerformanceTracking.v4.historian.queryHistoryByPath(tagPaths, start, end)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getRecipeHistoryForMachines: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getRecipeHistoryForMachines', 'Error2': 'Error retrieving batched recipe history', 'Error3': str(e)})
+
+def getRecipeRunTable(start, end, tagPath, rawDataSet=None, transitionsOnly=False, chunkMinutes=None, backend='tag'):
+    """
+    Retrieves the recipe runs of a shift as a RecipeRunTable. Takes the arguments of
+    getRecipeRunsFromHistorian.
+    """
+    if backend == 'sql' and rawDataSet is None:
+        return getRecipeRunTablesFromSQL(start, end, [tagPath])[tagPath]
+
+    if (transitionsOnly or chunkMinutes) and rawDataSet is None:
+        return compileRecipeRunTable(start, end, getRecipeTransitions(start, end, tagPath, chunkMinutes))
+
+    if rawDataSet is None:
+        rawDataSet = PerformanceTracking.v4.historian.queryTagHistory(paths=[tagPath], startDate=start, endDate=end, returnSize=-1, aggregationMode="Maximum", includeBoundingValues=True, returnFormat='Wide')
+        rawDataSet = PerformanceTracking.v4.historian.clampHistory(rawDataSet, start, end)
+
+    # Same changes as getUniqueRecipes, straight from the samples without intermediate datasets
+    samples = [(rawDataSet.getValueAt(row, 1), rawDataSet.getValueAt(row, 0)) for row in range(rawDataSet.getRowCount())]
+    return compileRecipeRunTable(start, end, collapseRecipeChanges(samples))
+
+def getRecipeRunsFromHistorian(start, end, tagPath, rawDataSet=None, transitionsOnly=False, chunkMinutes=None, backend='tag'):
     """
     Retrieves, filters, and compiles data for a specific shift.
     Args:
         start (Date): Shift start time.
         end (Date): Shift end time.
         tagPath (str): Path of the tag for querying historical data.
+        rawDataSet (dataset, optional): Recipe history already fetched by
+            getRecipeHistoryForMachines. The historian is queried when omitted.
+        transitionsOnly (bool): Query only the raw recipe changes and compile them
+            directly instead of deduplicating an aggregated history.
+        chunkMinutes (int, optional): Stream the raw recipe changes in chunks of this many
+            minutes, for long report windows. Implies transitionsOnly.
+        backend (str): 'tag' to read through queryTagHistory, 'sql' to compute the runs
+            directly in the historian database.
     Returns:
         dataset: A dataset with processed shift recipe runs.
     """
     try:
-        queryStart = start
-        rawDataSet = system.tag.queryTagHistory(paths=[tagPath], startDate=queryStart, endDate=end, returnSize=-1, aggregationMode="Maximum", returnFormat='Wide')
-   
-        uniqueDataSet = getUniqueRecipes(rawDataSet)
-
-        compiledShiftRecipeRuns = compileShiftRecipeData(start, end, uniqueDataSet)
-        
-        
-    
-        return compiledShiftRecipeRuns
+        return getRecipeRunTable(start, end, tagPath, rawDataSet, transitionsOnly, chunkMinutes, backend).toDataset()
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in getRecipeRunsFromHistorian: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getRecipeRunsFromHistorian', 'Error2': 'Error while processing shift data', 'Error3': str(e)})
 
+def getRecipeRunTablesFromSQL(start, end, tagPaths):
+    """
+    Computes the recipe runs of many recipe tags in the historian database as
+    RecipeRunTables, for bulk and backfill workloads.
+    Args:
+        start (Date): Shift start time.
+        end (Date): Shift end time.
+        tagPaths (list): Active Recipe tag paths.
+    Returns:
+        dict: Tag path -> RecipeRunTable.
+    """
+    dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+    runsByPath = PerformanceTracking.v4.historianSQL.getRecipeRuns(tagPaths, start, end)
+
+    runTables = {}
+    for tagPath, runs in runsByPath.items():
+        table = runTables[tagPath] = RecipeRunTable()
+        for recipe, runStart, runEnd in runs:
+            table.append(recipe, dateFormat.format(Date(runStart)), dateFormat.format(Date(runEnd)), runStart, runEnd)
+    return runTables
+
+def getRecipeTransitions(start, end, tagPath, chunkMinutes=None):
+    """
+    Retrieves only the value changes of a recipe tag, as stored, without aggregation.
+    The recipe active at the start comes from the bounding value of the same query.
+    Args:
+        start (Date): Query start time.
+        end (Date): Query end time.
+        tagPath (str): Path of the recipe tag.
+        chunkMinutes (int, optional): Stream the history in chunks of this many minutes,
+            so only one chunk and the collapsed changes are held in memory.
+    Returns:
+        list: Run-length list of (recipe, timestamp) pairs, one per recipe change.
+    """
+    try:
+        if chunkMinutes:
+            return collapseRecipeChanges(PerformanceTracking.v4.historian.iterHistory(tagPath, start, end, chunkMinutes))
+
+        rawDataSet = PerformanceTracking.v4.historian.queryTagHistory(paths=[tagPath], startDate=start, endDate=end, returnSize=-1, noInterpolation=True, includeBoundingValues=True, returnFormat='Tall')
+        valueIndex = rawDataSet.getColumnIndex("value")
+        timeIndex = rawDataSet.getColumnIndex("timestamp")
+        rows = [[rawDataSet.getValueAt(row, timeIndex), rawDataSet.getValueAt(row, valueIndex)] for row in range(rawDataSet.getRowCount())]
+        return collapseRecipeChanges((value, timestamp) for timestamp, value in PerformanceTracking.v4.historian.clampRows(rows, start, end))
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getRecipeTransitions: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getRecipeTransitions', 'Error2': 'Error retrieving recipe transitions', 'Error3': str(e)})
+
+def collapseRecipeChanges(samples):
+    """
+    Drops samples that repeat the previous recipe.
+    Args:
+        samples (iterable): (recipe, timestamp) pairs in time order.
+    Returns:
+        list: (recipe, timestamp) pairs, one per recipe change.
+    """
+    recipeChanges = []
+    for recipe, timestamp in samples:
+        if not recipeChanges or recipe != recipeChanges[-1][0]:
+            recipeChanges.append((recipe, timestamp))
+    return recipeChanges
+
 def getUniqueRecipes(dataSet):
     """
     Removes consecutive duplicate recipes and swaps the first two columns in a dataset.
@@ -47,54 +191,50 @@ def getUniqueRecipes(dataSet):
     
         headers = [dataSet.getColumnName(i) for i in range(dataSet.getColumnCount())]
         headers[0], headers[1] = headers[1], headers[0]
+        columnCount = dataSet.getColumnCount()
     
-        uniqueDataSet = toDataSet(headers, [])
+        # One pass into a run-length list, then the dataset is built once
+        uniqueRows = []
+        lastRecipe = None
         for i in range(dataSet.getRowCount()):
-            row = [dataSet.getValueAt(i, col) for col in range(dataSet.getColumnCount())]
+            row = [dataSet.getValueAt(i, col) for col in range(columnCount)]
             row[0], row[1] = row[1], row[0]
     
-            if i == 0 or row[0] != uniqueDataSet.getValueAt(uniqueDataSet.getRowCount() - 1, 0):
-                uniqueDataSet = addRow(uniqueDataSet, row)
+            if i == 0 or row[0] != lastRecipe:
+                uniqueRows.append(row)
+                lastRecipe = row[0]
     
-        return toPyDataSet(uniqueDataSet)
+        return toPyDataSet(toDataSet(headers, uniqueRows))
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in getUniqueRecipes: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getUniqueRecipes', 'Error2': 'Error while removing duplicates', 'Error3': str(e)})
 
-def compileShiftRecipeData(start, end, filteredDataSet):
+def compileRecipeRunTable(start, end, recipeChanges):
     """
-    Compiles recipe run data within a shift period.
+    Compiles recipe runs within a shift period into a RecipeRunTable.
     Args:
         start (Date): Shift start time.
         end (Date): Shift end time.
-        filteredDataSet (dataset): Filtered dataset of recipe changes.
+        recipeChanges (list): (recipe, timestamp) pairs, one per recipe change.
     Returns:
-        dataset: A dataset with compiled shift recipe data.
+        RecipeRunTable: The recipe runs.
     """
-    try:
-        headers = ["Recipe Name", "Start Time", "End Time", "Duration (Minutes)"]
-        shiftData = []
-        dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
-    
-        startStr, endStr = dateFormat.format(start), dateFormat.format(end)
-        endTimes = [filteredDataSet.getValueAt(i + 1, 1) if i < filteredDataSet.getRowCount() - 1 else endStr for i in range(filteredDataSet.getRowCount())]
-    
-        for i in range(filteredDataSet.getRowCount()):
-            recipe, startTime, endTime = filteredDataSet.getValueAt(i, 0), filteredDataSet.getValueAt(i, 1), endTimes[i]
-            if startTime < startStr <= endTime:
-                startTime = startStr
-            if startTime >= startStr:
-                duration = calculateMinutesBetweenTimes(startTime, endTime, dateFormat)
-                shiftData.append([recipe, startTime, endTime, duration])
-    
-        return toDataSet(headers, shiftData)
-    except Exception as e:
-        logger = system.util.getLogger("Exception_Error")
-        logger.error("ScriptError in compileShiftRecipeData: " + str(e))
-        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.compileShiftRecipeData', 'Error2': 'Error while compiling shift data', 'Error3': str(e)})
-        
+    table = RecipeRunTable()
+    dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
 
+    startStr, endStr = dateFormat.format(start), dateFormat.format(end)
+    changeTimes = [dateFormat.format(timestamp) if isinstance(timestamp, Date) else timestamp for recipe, timestamp in recipeChanges]
+    endTimes = changeTimes[1:] + [endStr]
+
+    for i in range(len(recipeChanges)):
+        recipe, startTime, endTime = recipeChanges[i][0], changeTimes[i], endTimes[i]
+        if startTime < startStr <= endTime:
+            startTime = startStr
+        if startTime >= startStr:
+            table.append(recipe, startTime, endTime, dateFormat.parse(startTime).getTime(), dateFormat.parse(endTime).getTime())
+
+    return table
 
 def machineNameRecipeBias(machineName):
 	
@@ -122,7 +262,7 @@ def getRecipeInfoFromDB(machineName):
         queryParams = {"machineName": machineName}
     
         # Run the named query
-        result = system.db.runNamedQuery(queryPath, queryParams)
+        result = PerformanceTracking.v4.singleFlight.runNamedQuery(queryPath, queryParams)
     
         return result
     except Exception as e:
@@ -173,6 +313,104 @@ def dictsToDataset(dictList):
         
 
 
+def getRecipeTargets(recipeNames, databaseRecipeTargets):
+    """
+    Looks up the setup time and cycle target of each recipe, using the 'default' recipe's
+    values when specific recipe info is missing.
+    Args:
+        recipeNames (list): Recipe name of each run.
+        databaseRecipeTargets (dataset): The dataset containing additional recipe info.
+    Returns:
+        tuple: (setup times, cycle targets), one entry per run.
+    """
+    hashJoin = PerformanceTracking.v4.hashJoin
+    index = hashJoin.buildIndex(databaseRecipeTargets, [0], [1, 2])
+    matches = hashJoin.probe(index, [(recipeName,) for recipeName in recipeNames], lambda key: ('default',))
+    return [match[0] for match in matches], [match[1] for match in matches]
+
+def mergeRecipeTargets(table, databaseRecipeTargets):
+    """
+    Fills the Setup Time and Cycle Target columns of a RecipeRunTable in place.
+    Args:
+        table (RecipeRunTable): The recipe runs.
+        databaseRecipeTargets (dataset): The dataset containing additional recipe info.
+    """
+    table.setupTimes, table.cycleTargets = getRecipeTargets(table.recipes, databaseRecipeTargets)
+
+# Target indexes built by getRecipeTargetIndex, kept per set of machine aliases. Targets only
+# change when a recipe is edited, so every timer run within the TTL reuses one index.
+TARGET_INDEX_GLOBALS_KEY = 'PerformanceTracking.v4.recipeTargetIndexes'
+TARGET_INDEX_TTL_MILLIS = 60000
+
+def getRecipeTargetIndex(machineNames):
+    """
+    Indexes the recipe targets of many machines on (machine alias, recipe name). The
+    targets come from the same scadaGetRecipeTable query main uses (getRecipeInfoFromDB),
+    whose machine filter decides which rows belong to a machine alias
+    (machineNameRecipeBias). The index is built once per set of aliases and reused from
+    the gateway globals for TARGET_INDEX_TTL_MILLIS, so a timer run only probes it.
+    Args:
+        machineNames (list): Names of the machines.
+    Returns:
+        dict: (machine alias, recipe name) -> (setup time, cycle target).
+    """
+    aliases = tuple(sorted(set(machineNameRecipeBias(machineName) for machineName in machineNames)))
+    indexes = system.util.getGlobals().setdefault(TARGET_INDEX_GLOBALS_KEY, {})
+    nowMillis = Date().getTime()
+    cached = indexes.get(aliases)
+    if cached is not None and cached[0] > nowMillis:
+        return cached[1]
+
+    hashJoin = PerformanceTracking.v4.hashJoin
+    targetIndex = {}
+    complete = True
+    for alias in aliases:
+        targets = getRecipeInfoFromDB(alias)
+        if targets is None:
+            complete = False
+            continue
+        for key, values in hashJoin.buildIndex(targets, [0], [1, 2]).items():
+            targetIndex[(alias,) + key] = values
+    if complete:
+        # Indexes of alias sets no longer in use expire with the rest
+        for key in [key for key, entry in indexes.items() if entry[0] <= nowMillis]:
+            indexes.pop(key, None)
+        indexes[aliases] = (nowMillis + TARGET_INDEX_TTL_MILLIS, targetIndex)
+    return targetIndex
+
+def joinRecipeTargets(runTables, targetIndex):
+    """
+    Fills the Setup Time and Cycle Target columns of the run tables of many machines in
+    one pass over the target index. Machines are matched under their recipe alias
+    (machineNameRecipeBias), and runs of recipes without targets use the machine's
+    'default' recipe.
+    Args:
+        runTables (dict): (systemName, machineName) -> RecipeRunTable.
+        targetIndex (dict): Index built with getRecipeTargetIndex.
+    Returns:
+        list: Machines with a run that has neither its recipe nor a 'default' target.
+            Their tables are left without targets.
+    """
+    machines = runTables.keys()
+    keys = []
+    for systemName, machineName in machines:
+        alias = machineNameRecipeBias(machineName)
+        keys.extend((alias, recipeName) for recipeName in runTables[(systemName, machineName)].recipes)
+
+    matches = PerformanceTracking.v4.hashJoin.probe(targetIndex, keys, lambda key: (key[0], 'default'))
+    offset = 0
+    unmatched = []
+    for machine in machines:
+        table = runTables[machine]
+        machineMatches = matches[offset:offset + table.getRowCount()]
+        offset += table.getRowCount()
+        if None in machineMatches:
+            unmatched.append(machine)
+            continue
+        table.setupTimes = [match[0] for match in machineMatches]
+        table.cycleTargets = [match[1] for match in machineMatches]
+    return unmatched
+
 def mergeShiftDataWithAdditionalInfo(shiftData, databaseRecipeTargets):
     """
     Merges shift data with additional recipe information, using default values when specific recipe info is missing.
@@ -183,32 +421,9 @@ def mergeShiftDataWithAdditionalInfo(shiftData, databaseRecipeTargets):
         dataset: Merged dataset.
     """
     try:
-        # Convert datasets to PyDataSets for easier manipulation
-        pyShiftData = toPyDataSet(shiftData)
-        pyAdditionalData = toPyDataSet(databaseRecipeTargets)
-    
-        # Create a dictionary for quick access to additional data, and extract the default values
-        defaultValues = None
-        additionalDataDict = {}
-        for row in pyAdditionalData:
-            recipeName, setupTime, cycleTarget = row[0], row[1], row[2]
-            additionalDataDict[recipeName] = (setupTime, cycleTarget)
-            if recipeName == 'default':
-                defaultValues = (setupTime, cycleTarget)
-    
-        # Prepare data for the new dataset
-        enhancedRows = []
-        for row in pyShiftData:
-            recipeName = row[0]
-            additionalData = additionalDataDict.get(recipeName, defaultValues)
-            newRow = list(row) + list(additionalData)
-            enhancedRows.append(newRow)
-    
-        # Define new column names
-        newColumnNames = list(shiftData.getColumnNames()) + ["Setup Time", "Cycle Target"]
-    
-        # Create and return the new dataset
-        return toDataSet(newColumnNames, enhancedRows)
+        setupTimes, cycleTargets = getRecipeTargets(PerformanceTracking.v4.datasetColumns.getColumn(shiftData, "Recipe Name"), databaseRecipeTargets)
+        # The shift data columns are shared, not copied row by row
+        return PerformanceTracking.v4.datasetColumns.appendColumns(shiftData, [("Setup Time", setupTimes), ("Cycle Target", cycleTargets)])
     
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
@@ -241,27 +456,39 @@ def calculateMinutesBetweenTimes(start, end, format):
 
 
 
-def calculateIdleTime(recipeRunsInfo, idlePath):
+def calculateIdleTime(recipeRunsInfo, idlePath, idleIndex=None):
     """
     Calculates the idle time for each recipe run.
+    The Machine Idle history is read once for the span of all runs, and the idle time
+    of every run is taken from it in one sweep; per run it equals a DurationOn
+    calculation over the run (getIdleTimeForRecipe).
     Args:
         recipeRunsInfo (dataset): The dataset containing recipe runs.
         idlePath (str): The tag path for machine idle status.
+        idleIndex (dict, optional): Interval index of the Machine Idle tag covering the
+            runs (stateIntervals.fetchIndex); used instead of reading the history.
     Returns:
         list: List of idle times for each recipe run.
     """
     try:
         dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
-        idleTimes = []
+        windows = []
     
         for i in range(recipeRunsInfo.getRowCount()):
             startStr = recipeRunsInfo.getValueAt(i, "Start Time")
             endStr = recipeRunsInfo.getValueAt(i, "End Time")
-            startTime = dateFormat.parse(startStr)
-            endTime = dateFormat.parse(endStr)
-            idleTimeSeconds = getIdleTimeForRecipe(idlePath, startTime, endTime)
-            idleTimeMinutes = round(idleTimeSeconds / 60.0, 2)
-            idleTimes.append(idleTimeMinutes)
+            windows.append((dateFormat.parse(startStr).getTime(), dateFormat.parse(endStr).getTime()))
+
+        if not windows:
+            return []
+
+        if idleIndex is not None:
+            idleMillis = [PerformanceTracking.v4.stateIntervals.durationOnMillis(idleIndex, runStart, runEnd) for runStart, runEnd in windows]
+        else:
+            idleIntervals = PerformanceTracking.v4.stateIntervals.fetchOnIntervals(idlePath, Date(windows[0][0]), Date(windows[-1][1]))
+            idleMillis = PerformanceTracking.v4.stateIntervals.overlapByWindow(idleIntervals, windows)
+        # DurationOn is read in whole seconds, as getIdleTimeForRecipe does
+        idleTimes = [round(int(millis / 1000) / 60.0, 2) for millis in idleMillis]
     
         return idleTimes
     except Exception as e:
@@ -272,6 +499,46 @@ def calculateIdleTime(recipeRunsInfo, idlePath):
 
 
 
+def calculateRunStates(table, rootTagPath, idleIndex=None, cycleIndex=None):
+    """
+    Fills the idle time and actual parts of each recipe run in place, in one sweep over
+    the Machine Idle and Cycle Done states (see stateIntervals.clipToWindows). Actual parts
+    are the Cycle Done rising edges inside the run.
+    Args:
+        table (RecipeRunTable): The recipe runs.
+        rootTagPath (str): Root tag path of the machine.
+        idleIndex (dict, optional): Interval index of the Machine Idle tag covering the runs.
+        cycleIndex (dict, optional): Interval index of the Cycle Done tag covering the runs.
+            Each signal uses its index when one is given; a tag without one is read once
+            over the span of the runs.
+    """
+    try:
+        stateIntervals = PerformanceTracking.v4.stateIntervals
+        table.idleTimes = []
+        table.actualParts = []
+        if not table.getRowCount():
+            return
+
+        windows = zip(range(table.getRowCount()), table.startMillis, table.endMillis)
+        signals = {}
+        spanStart, spanEnd = Date(table.startMillis[0]), Date(table.endMillis[-1])
+        for signal, index, tagPath in (('idle', idleIndex, rootTagPath + 'machineStatus/Machine Idle'), ('cycleDone', cycleIndex, rootTagPath + 'machineStatus/Cycle Done')):
+            if index is not None:
+                signals[signal] = (zip(index['starts'], index['ends']), index['edges'])
+            else:
+                edges = []
+                signals[signal] = (stateIntervals.getOnIntervals(stateIntervals.fetchSamples(tagPath, spanStart, spanEnd), spanStart, spanEnd, edges), edges)
+
+        results = stateIntervals.clipToWindows(signals, windows)
+        for i, runStart, runEnd in windows:
+            # DurationOn is read in whole seconds, as getIdleTimeForRecipe does
+            table.idleTimes.append(round(int(results[i]['idle']['durationOn'] / 1000) / 60.0, 2))
+            table.actualParts.append(results[i]['cycleDone']['countOn'])
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in calculateRunStates: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.calculateRunStates', 'Error2': 'Error calculating run states', 'Error3': str(e)})
+
 def getIdleTimeForRecipe(idlePath, startTime, endTime):
     """
     Calculate the idle time for the machine during a specific time period.
@@ -284,13 +551,27 @@ def getIdleTimeForRecipe(idlePath, startTime, endTime):
     """
     try:
         paths = [idlePath]
-        durationResult = system.tag.queryTagCalculations(paths, ["DurationOn"], startTime, endTime)
+        durationResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["DurationOn"], startTime, endTime)
         return int(durationResult.getValueAt(0, 1))
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in getIdleTimeForRecipe: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getIdleTimeForRecipe', 'Error2': 'Error during idle time calculation', 'Error3': str(e)})
 
+def expectedPartsForRun(duration, setupTime, idleTime, cycleTarget):
+    """
+    Expected parts of one recipe run: the running minutes over the cycle target, never less than 0.
+    """
+    rawExpectedParts = (duration - setupTime - idleTime) / cycleTarget
+    return int(max(floor(rawExpectedParts), 0))
+
+def fillExpectedParts(table):
+    """
+    Fills the expected parts of each recipe run in place, from the duration, setup time,
+    cycle target and idle time columns of the table.
+    """
+    table.expectedParts = [expectedPartsForRun(*run) for run in zip(table.durations, table.setupTimes, table.idleTimes, table.cycleTargets)]
+
 def calculateExpectedParts(recipeRunsInfo, idleTimes, rootTagPath):
     """
     Calculates expected parts for each recipe run.
@@ -303,17 +584,9 @@ def calculateExpectedParts(recipeRunsInfo, idleTimes, rootTagPath):
     try:
         expectedPartsList = []
     
-        for i in range(recipeRunsInfo.getRowCount()):
-            duration = recipeRunsInfo.getValueAt(i, "Duration (Minutes)")
-            setupTime = recipeRunsInfo.getValueAt(i, "Setup Time")
-            idleTime = idleTimes[i]
-            cycleTarget = recipeRunsInfo.getValueAt(i, "Cycle Target")
-    
-            # Calculate expected parts
-            rawExpectedParts = (duration - setupTime - idleTime) / cycleTarget
-            expectedParts = max(floor(rawExpectedParts), 0)  # Ensuring expectedParts is never less than 0
-    
-            expectedPartsList.append(int(expectedParts))  # Convert to integer
+        runs = PerformanceTracking.v4.datasetColumns.zipColumns(recipeRunsInfo, "Duration (Minutes)", "Setup Time", "Cycle Target")
+        for (duration, setupTime, cycleTarget), idleTime in zip(runs, idleTimes):
+            expectedPartsList.append(expectedPartsForRun(duration, setupTime, idleTime, cycleTarget))
     
         return expectedPartsList
     except Exception as e:
@@ -322,27 +595,23 @@ def calculateExpectedParts(recipeRunsInfo, idleTimes, rootTagPath):
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.calculateExpectedParts', 'Error2': 'Error calculating expected parts', 'Error3': str(e)})
 
 
-def enhanceDataSetWithColumns(dataSet, idleTimes, expectedParts, rootTagPath):
+def enhanceDataSetWithColumns(dataSet, idleTimes, expectedParts, rootTagPath, actualParts=None):
     """
     Enhances the dataset with additional columns for idle time and expected parts.
     Args:
         dataSet (dataset): The original dataset.
         idleTimes (list): List of idle times.
         expectedParts (list): List of expected parts.
+        actualParts (list, optional): List of actual parts, added as an "Actual Parts" column.
     Returns:
         dataset: Enhanced dataset.
     """
     try:
-        columnNames = list(dataSet.getColumnNames()) + ["Idle Time (Minutes)", "Expected Parts"]
-        enhancedRows = []
-    
-        for i in range(dataSet.getRowCount()):
-            row = list(dataSet.getValueAt(i, j) for j in range(dataSet.getColumnCount()))
-            row.append(idleTimes[i])
-            row.append(expectedParts[i])
-            enhancedRows.append(row)
-    
-        return toDataSet(columnNames, enhancedRows)
+        columns = [("Idle Time (Minutes)", idleTimes), ("Expected Parts", expectedParts)]
+        if actualParts is not None:
+            columns.append(("Actual Parts", actualParts))
+        # The existing columns are shared, not copied row by row
+        return PerformanceTracking.v4.datasetColumns.appendColumns(dataSet, columns)
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in enhanceDataSetWithColumns: " + str(e))
@@ -353,7 +622,248 @@ def enhanceDataSetWithColumns(dataSet, idleTimes, expectedParts, rootTagPath):
 
 
 
-def main(systemName, machineName, start, end):
+WATERMARK_GLOBALS_KEY = 'PerformanceTracking.v4.recipeRunWatermarks'
+RECIPE_RUN_COLUMNS = ["Recipe Name", "Start Time", "End Time", "Duration (Minutes)", "Setup Time", "Cycle Target", "Idle Time (Minutes)", "Expected Parts"]
+
+def toDate(value, dateFormat):
+    """
+    Converts a timestamp read from a dataset or the database to a Date.
+    Args:
+        value (Date or str): The timestamp to convert.
+        dateFormat (SimpleDateFormat): Format used to parse string timestamps.
+    Returns:
+        Date: The timestamp as a Date, or None when value is None.
+    """
+    if value is None or isinstance(value, Date):
+        return value
+    return dateFormat.parse(str(value))
+
+def getRecipeRunWatermark(machineUniqueName, start, end):
+    """
+    Returns the end of the last closed recipe run for a machine.
+    The watermark is kept in the gateway globals and recovered from the RecipeRunData
+    store after a restart. It is the start of the last stored run, because that run may
+    still have been open when it was stored.
+    Args:
+        machineUniqueName (str): System and machine name joined by '/'.
+        start (Date): Start time of the shift.
+        end (Date): End time of the shift.
+    Returns:
+        Date: The watermark, or None when no run of this shift has been closed yet.
+    """
+    try:
+        watermarks = system.util.getGlobals().setdefault(WATERMARK_GLOBALS_KEY, {})
+        watermark = watermarks.get(machineUniqueName)
+
+        if watermark is None or not system.date.isAfter(watermark, start) or system.date.isAfter(watermark, end):
+            dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+            # Runs superseded by a reconciliation are skipped, so they cannot move the watermark
+            storedRows = getStoredRecipeRuns(machineUniqueName, start, end, RECIPE_RUN_COLUMNS)
+            watermark = toDate(storedRows[-1][1], dateFormat) if storedRows else None
+            if watermark is not None and not system.date.isAfter(watermark, start):
+                watermark = None
+            watermarks[machineUniqueName] = watermark
+
+        return watermark
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getRecipeRunWatermark: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getRecipeRunWatermark', 'Error2': 'Error retrieving recipe run watermark', 'Error3': str(e)})
+
+def dropSupersededRuns(rows):
+    """
+    Drops stored runs that a reconciliation superseded. Amended runs are upserted by
+    their start time, so when late history moved a run's start or merged two runs the
+    old row stays in the store and overlaps the run that replaced it. Runs follow each
+    other without overlap, so a run starting before the previous kept run ended is stale.
+    Args:
+        rows (list): Rows with the recipe name, start and end time first, in time order.
+    Returns:
+        list: The rows that are not superseded.
+    """
+    kept = []
+    for row in rows:
+        if kept and row[1] < kept[-1][2]:
+            continue
+        kept.append(row)
+    return kept
+
+def getStoredRecipeRuns(machineUniqueName, start, watermark, columnNames):
+    """
+    Reads the closed recipe runs before the watermark from the RecipeRunData store.
+    Runs superseded by a reconciliation are left out (dropSupersededRuns).
+    Args:
+        machineUniqueName (str): System and machine name joined by '/'.
+        start (Date): Start time of the shift.
+        watermark (Date): End of the last closed run.
+        columnNames (list): Column names of the recipe run table to return.
+    Returns:
+        list: Rows ordered like columnNames, with timestamps formatted as strings.
+    """
+    try:
+        dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+        storedRuns = PerformanceTracking.v4.retrieveRecipeRunDB.retrieveRecipeRunDataFromDB(machineUniqueName, start, watermark)
+        rows = []
+        for row in range(storedRuns.getRowCount()):
+            runStart = toDate(storedRuns.getValueAt(row, "Start Time"), dateFormat)
+            if not system.date.isBefore(runStart, start) and system.date.isBefore(runStart, watermark):
+                values = [storedRuns.getValueAt(row, columnName) for columnName in columnNames]
+                for timeColumn in ("Start Time", "End Time"):
+                    index = columnNames.index(timeColumn)
+                    values[index] = dateFormat.format(toDate(values[index], dateFormat))
+                rows.append(values)
+        rows.sort(key=lambda values: values[1])
+        return dropSupersededRuns(rows)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getStoredRecipeRuns: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getStoredRecipeRuns', 'Error2': 'Error reading stored recipe runs', 'Error3': str(e)})
+
+def getReconcileStart(storedRows, start, watermark, reconcileMinutes):
+    """
+    Finds where a reconciliation pass starts: the start of the stored run that was active
+    reconcileMinutes before the watermark, so the pass begins on a run boundary.
+    Args:
+        storedRows (list): Closed runs from getStoredRecipeRuns, in time order.
+        start (Date): Start time of the shift.
+        watermark (Date): End of the last closed run.
+        reconcileMinutes (int): Length of the trailing window behind the watermark.
+    Returns:
+        Date: Start of the reconciliation window.
+    """
+    dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+    reconcileFrom = dateFormat.format(system.date.addMinutes(watermark, -reconcileMinutes))
+    runStarts = [row[1] for row in storedRows if row[1] <= reconcileFrom]
+    return toDate(runStarts[-1], dateFormat) if runStarts else start
+
+def getIncrementalHistoryStart(machines, start, end, reconcileMinutes=None):
+    """
+    Finds where a batched Active Recipe history for incremental runs can start: the
+    earliest watermark of the machines, moved back by reconcileMinutes. A machine whose
+    window still starts earlier reads its own history (see incrementalMain).
+    Args:
+        machines (list): (systemName, machineName) pairs.
+        start (Date): Start time of the shift.
+        end (Date): End time of the shift.
+        reconcileMinutes (int, optional): Trailing window behind the watermark to re-examine.
+    Returns:
+        Date: Start of the batched history, not before the shift start.
+    """
+    historyStart = None
+    for systemName, machineName in machines:
+        watermark = getRecipeRunWatermark(systemName + '/' + machineName, start, end)
+        if watermark is None:
+            return start
+        if reconcileMinutes:
+            watermark = system.date.addMinutes(watermark, -reconcileMinutes)
+        if historyStart is None or system.date.isBefore(watermark, historyStart):
+            historyStart = watermark
+    if historyStart is None or system.date.isBefore(historyStart, start):
+        return start
+    return historyStart
+
+def invalidateReconcileWindows(machines, start, end, reconcileMinutes):
+    """
+    Drops the cached history of the machines' reconciliation windows, so samples that
+    arrived late are read again. Only each machine's own Active Recipe and state tags are
+    dropped, from reconcileMinutes behind its watermark, in one pass over the cache.
+    Args:
+        machines (list): (systemName, machineName) pairs.
+        start (Date): Start time of the shift.
+        end (Date): End time of the shift.
+        reconcileMinutes (int): Length of the trailing window behind the watermark.
+    """
+    sinceByPath = {}
+    for systemName, machineName in machines:
+        watermark = getRecipeRunWatermark(systemName + '/' + machineName, start, end)
+        if watermark is None:
+            continue
+        since = system.date.addMinutes(watermark, -reconcileMinutes)
+        rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+        for suffix in ('Active Recipe', 'machineStatus/Machine Idle', 'machineStatus/Cycle Done', 'machineStatus/In Cycle'):
+            sinceByPath[rootTagPath + suffix] = since
+    if sinceByPath:
+        PerformanceTracking.v4.historian.invalidateCache(sinceByPath)
+
+def isSameRecipeRun(storedRow, newRow):
+    """
+    Compares a stored recipe run with a recomputed one, allowing for rounding of
+    numeric columns in the database.
+    """
+    for storedValue, newValue in zip(storedRow, newRow):
+        if isinstance(storedValue, (int, long, float)) and isinstance(newValue, (int, long, float)):
+            if abs(storedValue - newValue) > 0.005:
+                return False
+        elif storedValue != newValue:
+            return False
+    return True
+
+def incrementalMain(systemName, machineName, start, end, recipeHistory=None, transitionsOnly=False, reconcileMinutes=None):
+    """
+    Incremental variant of main. Only the window after the machine's watermark is read
+    from the historian; the closed runs before it come from the RecipeRunData store.
+    Only new or changed runs are upserted and the watermark moves to the start of the
+    run that is still open.
+    With reconcileMinutes, the window is widened to that many minutes behind the
+    watermark so history that arrived late through store-and-forward amends the runs
+    it falls into, without recomputing the whole shift. The caller drops the cached
+    history of that window first (invalidateReconcileWindows).
+    Args:
+        systemName (str): Name of the system.
+        machineName (str): Name of the machine.
+        start (Date): Start time of the shift.
+        end (Date): End time of the shift.
+        recipeHistory (dataset, optional): Pre-fetched Active Recipe history for this machine.
+        transitionsOnly (bool): Retrieve only the raw recipe changes from the historian.
+        reconcileMinutes (int, optional): Trailing window behind the watermark to re-examine.
+    Returns:
+        dataset: Final dataset with additional information for the whole shift.
+    """
+    try:
+        machineUniqueName = systemName + '/' + machineName
+        watermark = getRecipeRunWatermark(machineUniqueName, start, end)
+        storedRows = []
+        queryStart = start
+        if watermark is not None:
+            storedRows = getStoredRecipeRuns(machineUniqueName, start, watermark, RECIPE_RUN_COLUMNS)
+            queryStart = watermark
+            if reconcileMinutes:
+                queryStart = getReconcileStart(storedRows, start, watermark, reconcileMinutes)
+
+        # A batched history that starts after this machine's window cannot seed it
+        if recipeHistory is not None and recipeHistory.getRowCount() > 0 and system.date.isAfter(recipeHistory.getValueAt(0, 0), queryStart):
+            recipeHistory = None
+
+        # Only the runs from the watermark, or the reconciliation window, onwards are recomputed
+        newRuns = main(systemName, machineName, queryStart, end, recipeHistory, transitionsOnly)
+        if newRuns is None or newRuns.getRowCount() == 0:
+            # Nothing after the watermark: the stored runs stand and the watermark stays
+            if storedRows:
+                return toDataSet(RECIPE_RUN_COLUMNS, storedRows)
+            return newRuns
+
+        dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+        queryStartStr = dateFormat.format(queryStart)
+        storedByStart = dict((row[1], row) for row in storedRows if row[1] >= queryStartStr)
+        newRows = [[newRuns.getValueAt(row, columnName) for columnName in RECIPE_RUN_COLUMNS] for row in range(newRuns.getRowCount())]
+
+        # Amend only the runs that are new or changed since they were stored
+        changedRows = [row for row in newRows if row[1] not in storedByStart or not isSameRecipeRun(storedByStart[row[1]], row)]
+        if changedRows:
+            PerformanceTracking.v4.upsertRecipeRunDB.insertRecipeRunData(toDataSet(RECIPE_RUN_COLUMNS, changedRows), machineUniqueName)
+
+        # The last run is still open, so the watermark moves to its start
+        lastRunStart = toDate(newRows[-1][1], dateFormat)
+        system.util.getGlobals().setdefault(WATERMARK_GLOBALS_KEY, {})[machineUniqueName] = lastRunStart
+
+        rows = [row for row in storedRows if row[1] < queryStartStr] + newRows
+        return toDataSet(RECIPE_RUN_COLUMNS, rows)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in incrementalMain: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.incrementalMain', 'Error2': 'Error processing incremental recipe run info', 'Error3': str(e)})
+
+def main(systemName, machineName, start, end, recipeHistory=None, transitionsOnly=False, chunkMinutes=None, backend='tag', idleIndex=None, cycleIndex=None):
     """
     Main function to process shift data and calculate expected parts.
     Args:
@@ -361,6 +871,13 @@ def main(systemName, machineName, start, end):
         machineName (str): Name of the machine.
         start (Date): Start time of the shift.
         end (Date): End time of the shift.
+        recipeHistory (dataset, optional): Pre-fetched Active Recipe history for this machine.
+        transitionsOnly (bool): Retrieve only the raw recipe changes from the historian.
+        chunkMinutes (int, optional): Stream the recipe history in chunks of this many
+            minutes, for long report windows.
+        backend (str): 'tag' for queryTagHistory, 'sql' to compute the runs in the historian database.
+        idleIndex (dict, optional): Interval index of the Machine Idle tag over the shift.
+        cycleIndex (dict, optional): Interval index of the Cycle Done tag over the shift.
     Returns:
         dataset: Final dataset with additional information.
     """
@@ -370,27 +887,22 @@ def main(systemName, machineName, start, end):
     	rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
         idleTagPath = rootTagPath + 'machineStatus/Machine Idle'
         recipeTagPath = rootTagPath + 'Active Recipe'
-        # Retrieve and process shift data
-        shiftData = getRecipeRunsFromHistorian(start, end, recipeTagPath)
+        # Retrieve and process shift data; every stage fills the run table in place
+        runTable = getRecipeRunTable(start, end, recipeTagPath, recipeHistory, transitionsOnly, chunkMinutes, backend)
     
         # Convert the recipe dictionary to a dataset
         databaseRecipeTargets = getRecipeInfoFromDB(machineName)
     
-    
         # Merge shift data with additional recipe data (setup time and cycle target)
-        shiftDataWithAdditionalInfo = mergeShiftDataWithAdditionalInfo(shiftData, databaseRecipeTargets)
-    
+        mergeRecipeTargets(runTable, databaseRecipeTargets)
     
-        # Calculate idle times
-        idleTimes = calculateIdleTime(shiftDataWithAdditionalInfo, idleTagPath)
+        # Calculate idle times and actual parts
+        calculateRunStates(runTable, rootTagPath, idleIndex, cycleIndex)
     
         # Calculate expected parts
-        expectedParts = calculateExpectedParts(shiftDataWithAdditionalInfo, idleTimes, rootTagPath)
+        fillExpectedParts(runTable)
     
-        expectedPartsTable = enhanceDataSetWithColumns(shiftDataWithAdditionalInfo, idleTimes, expectedParts, rootTagPath)
-    
-    
-        return expectedPartsTable
+        return runTable.toDataset()
     
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
@@ -400,6 +912,67 @@ def main(systemName, machineName, start, end):
         
 
 	
+def logMachineSkipped(systemName, machineName, reason):
+    """
+    Records a machine left out of mainForMachines; the other machines carry on.
+    """
+    logger = system.util.getLogger("Exception_Error")
+    logger.error("ScriptError in mainForMachines for " + systemName + "/" + machineName + ": " + reason)
+    system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.mainForMachines', 'Error2': 'Recipe run info skipped for ' + systemName + '/' + machineName, 'Error3': reason})
+
+def mainForMachines(machines, start, end, recipeHistory=None, transitionsOnly=False, stateIndexes=None):
+    """
+    Batch form of main for many machines. The recipe targets are read and indexed once,
+    and joined onto the runs of every machine in one pass (joinRecipeTargets). A machine
+    that fails, or has a run without its recipe or a 'default' target, is logged and
+    left out; the others are still returned.
+    Args:
+        machines (list): (systemName, machineName) pairs.
+        start (Date): Start time of the shift.
+        end (Date): End time of the shift.
+        recipeHistory (dict, optional): (systemName, machineName) -> pre-fetched Active Recipe history.
+        transitionsOnly (bool): Retrieve only the raw recipe changes from the historian.
+        stateIndexes (dict, optional): (systemName, machineName) -> (idleIndex, cycleIndex)
+            over the shift.
+    Returns:
+        dict: (systemName, machineName) -> dataset, as main returns it, for the machines
+            that succeeded.
+    """
+    try:
+        recipeHistory = recipeHistory or {}
+        stateIndexes = stateIndexes or {}
+        runTables = {}
+        for systemName, machineName in machines:
+            try:
+                recipeTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/Active Recipe'
+                runTables[(systemName, machineName)] = getRecipeRunTable(start, end, recipeTagPath, recipeHistory.get((systemName, machineName)), transitionsOnly)
+            except Exception as e:
+                logMachineSkipped(systemName, machineName, str(e))
+
+        targetIndex = getRecipeTargetIndex([machineName for systemName, machineName in runTables.keys()])
+        for systemName, machineName in joinRecipeTargets(runTables, targetIndex):
+            logMachineSkipped(systemName, machineName, "No recipe target or 'default' row for a recipe run")
+            del runTables[(systemName, machineName)]
+
+        recipeRunData = {}
+        for (systemName, machineName), runTable in runTables.items():
+            try:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                idleIndex, cycleIndex = stateIndexes.get((systemName, machineName), (None, None))
+                calculateRunStates(runTable, rootTagPath, idleIndex, cycleIndex)
+                if runTable.actualParts is None or len(runTable.actualParts) != runTable.getRowCount():
+                    raise ValueError("Run states could not be calculated")
+                fillExpectedParts(runTable)
+                recipeRunData[(systemName, machineName)] = runTable.toDataset()
+            except Exception as e:
+                logMachineSkipped(systemName, machineName, str(e))
+        return recipeRunData
+
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in mainForMachines: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.mainForMachines', 'Error2': 'Error processing recipe run info for many machines', 'Error3': str(e)})
+
 def diagnostic(systemName, machineName, start, end):
     """
     Main function to process shift data and calculate expected parts.
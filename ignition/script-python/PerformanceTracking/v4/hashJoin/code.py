@@ -0,0 +1,41 @@
+import system
+
+
+def buildIndex(dataSet, keyColumns, valueColumns):
+    """
+    Builds a hash index over a table, for joining many rows against it.
+    When several rows share a key, the last one wins.
+
+    Args:
+        dataSet (dataset): The table to index, such as the recipe targets.
+        keyColumns (list): Names or indexes of the columns forming the key.
+        valueColumns (list): Names or indexes of the columns to return on a match.
+    Returns:
+        dict: Key tuple -> tuple of values.
+    """
+    index = {}
+    keyCount = len(keyColumns)
+    for row in PerformanceTracking.v4.datasetColumns.zipColumns(dataSet, *(list(keyColumns) + list(valueColumns))):
+        index[row[:keyCount]] = row[keyCount:]
+    return index
+
+def probe(index, keys, fallback=None):
+    """
+    Joins keys against an index in one pass.
+
+    Args:
+        index (dict): Index built with buildIndex.
+        keys (list): Key tuples to look up.
+        fallback (callable, optional): Maps a key without a match to the key of the row
+            to use instead, such as the machine's 'default' recipe.
+    Returns:
+        list: The matched values for each key, or None when neither the key nor its
+            fallback is in the index.
+    """
+    matches = []
+    for key in keys:
+        values = index.get(key)
+        if values is None and fallback is not None:
+            values = index.get(fallback(key))
+        matches.append(values)
+    return matches
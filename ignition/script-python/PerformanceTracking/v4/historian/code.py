@@ -0,0 +1,513 @@
+import sys
+import system
+from java.util import Date, LinkedHashMap
+from java.util.concurrent import Callable, Executors, Semaphore, TimeUnit, TimeoutException
+from java.util.concurrent.atomic import AtomicBoolean
+from java.util.concurrent.locks import ReentrantLock
+from system.dataset import toDataSet
+
+# Width of each historian query made by iterHistory
+DEFAULT_CHUNK_MINUTES = 60
+
+# Shared result cache, kept in the gateway globals so every caller sees the same entries
+CACHE_GLOBALS_KEY = 'PerformanceTracking.v4.historianCache'
+# Size budget of the cache, in dataset cells (rows x columns)
+CACHE_CELL_BUDGET = 2000000
+# Windows ending less than this long ago are open; their results expire after it
+OPEN_WINDOW_TTL_MILLIS = 5000
+# Windows ending less than this long ago may still receive store-and-forward history,
+# so their results also expire after OPEN_WINDOW_TTL_MILLIS
+LATE_DATA_HORIZON_MILLIS = 30 * 60 * 1000
+
+# Concurrency limit and deadlines of the historian client, kept in the gateway globals
+CLIENT_GLOBALS_KEY = 'PerformanceTracking.v4.historianClient'
+# Historian queries allowed to run at once across the gateway
+DEFAULT_MAX_CONCURRENT_QUERIES = 4
+# Deadline of a single historian query
+DEFAULT_QUERY_TIMEOUT_MILLIS = 30000
+# How long a caller waits for a free slot before failing fast
+DEFAULT_ACQUIRE_TIMEOUT_MILLIS = 5000
+
+
+class LimitedCallable(Callable):
+    """
+    Runs a historian query on the client executor, captures its outcome and frees its
+    concurrency slot when the query really finishes, even after the caller gave up.
+    Whichever of the task and the caller first claims 'started' owns the slot: a task
+    cancelled before it ran never reaches its finally, so the caller frees it instead.
+    """
+    def __init__(self, function, semaphore):
+        self.function = function
+        self.semaphore = semaphore
+        self.started = AtomicBoolean(False)
+
+    def call(self):
+        if not self.started.compareAndSet(False, True):
+            return (False, None)
+        try:
+            return (True, self.function())
+        except:
+            return (False, sys.exc_info())
+        finally:
+            self.semaphore.release()
+
+
+def getClient():
+    """
+    Returns the gateway-wide historian client state, creating it on first use.
+
+    Returns:
+        dict: 'semaphore', 'executor', 'timeoutMillis' and 'acquireTimeoutMillis'.
+    """
+    globalVars = system.util.getGlobals()
+    client = globalVars.get(CLIENT_GLOBALS_KEY)
+    if client is None:
+        client = globalVars.setdefault(CLIENT_GLOBALS_KEY, {
+            'semaphore': Semaphore(DEFAULT_MAX_CONCURRENT_QUERIES, True),
+            'executor': Executors.newCachedThreadPool(),
+            'timeoutMillis': DEFAULT_QUERY_TIMEOUT_MILLIS,
+            'acquireTimeoutMillis': DEFAULT_ACQUIRE_TIMEOUT_MILLIS
+        })
+    return client
+
+def configureClient(maxConcurrentQueries=None, timeoutMillis=None, acquireTimeoutMillis=None):
+    """
+    Changes the concurrency limit and deadlines of the historian client.
+    Queries already running keep the slot they hold.
+
+    Args:
+        maxConcurrentQueries (int, optional): Historian queries allowed to run at once.
+        timeoutMillis (int, optional): Default deadline of a single query.
+        acquireTimeoutMillis (int, optional): How long to wait for a free slot.
+    """
+    client = getClient()
+    if maxConcurrentQueries is not None:
+        client['semaphore'] = Semaphore(maxConcurrentQueries, True)
+    if timeoutMillis is not None:
+        client['timeoutMillis'] = timeoutMillis
+    if acquireTimeoutMillis is not None:
+        client['acquireTimeoutMillis'] = acquireTimeoutMillis
+
+def limitedCall(function, timeoutMillis=None):
+    """
+    Runs a historian query within the client's concurrency limit and deadline.
+    A caller that cannot get a slot within the acquire timeout fails fast instead of
+    queueing behind a slow historian, and a query that misses its deadline is cancelled.
+
+    Args:
+        function (callable): Function without arguments that performs the query.
+        timeoutMillis (int, optional): Deadline of this call; the client default when omitted.
+    Returns:
+        The result of function.
+    """
+    client = getClient()
+    semaphore = client['semaphore']
+    if timeoutMillis is None:
+        timeoutMillis = client['timeoutMillis']
+
+    if not semaphore.tryAcquire(client['acquireTimeoutMillis'], TimeUnit.MILLISECONDS):
+        raise RuntimeError("Historian busy: no query slot free within %d ms" % client['acquireTimeoutMillis'])
+
+    task = LimitedCallable(function, semaphore)
+    try:
+        future = client['executor'].submit(task)
+    except:
+        semaphore.release()
+        raise
+
+    try:
+        succeeded, outcome = future.get(timeoutMillis, TimeUnit.MILLISECONDS)
+    except TimeoutException:
+        future.cancel(True)
+        if task.started.compareAndSet(False, True):
+            # Never ran, so its finally will not free the slot
+            semaphore.release()
+        raise RuntimeError("Historian query exceeded its %d ms deadline" % timeoutMillis)
+
+    if not succeeded:
+        raise outcome[0], outcome[1], outcome[2]
+    return outcome
+
+
+def getCache():
+    """
+    Returns the gateway-wide historian cache, creating it on first use.
+
+    Returns:
+        dict: 'entries' (access ordered LinkedHashMap of key -> [dataset, expiry, cells, window end]),
+            'cells' (cells currently held), 'lock', 'hits' and 'misses'.
+    """
+    globalVars = system.util.getGlobals()
+    cache = globalVars.get(CACHE_GLOBALS_KEY)
+    if cache is None:
+        cache = globalVars.setdefault(CACHE_GLOBALS_KEY, {'entries': LinkedHashMap(16, 0.75, True), 'cells': 0, 'lock': ReentrantLock(), 'hits': 0, 'misses': 0})
+    return cache
+
+def clearCache():
+    """
+    Drops every cached historian result.
+    """
+    cache = getCache()
+    cache['lock'].lock()
+    try:
+        cache['entries'].clear()
+        cache['cells'] = 0
+    finally:
+        cache['lock'].unlock()
+
+def cachedPaths(key):
+    """
+    Returns the tag paths of a cache key: the paths keyword of a history query, or the
+    first argument of a calculations query.
+    """
+    for name, value in key[2]:
+        if name == 'paths':
+            return value or ()
+    if key[1] and isinstance(key[1][0], tuple):
+        return key[1][0]
+    return ()
+
+def invalidateCache(sinceByPath):
+    """
+    Drops the cached results of some tags for windows ending at or after a point in
+    time, so history that arrived late for that period is read again. Results of other
+    tags stay cached, and results that already expire on their own are left alone. A
+    result covering several tags is dropped when one of them is affected.
+
+    Args:
+        sinceByPath (dict): Tag path -> start (Date) of the period that received late history.
+    """
+    sinceByKey = dict((historyPathKey(tagPath), since.getTime()) for tagPath, since in sinceByPath.items())
+    cache = getCache()
+    cache['lock'].lock()
+    try:
+        iterator = cache['entries'].entrySet().iterator()
+        while iterator.hasNext():
+            mapEntry = iterator.next()
+            entry = mapEntry.getValue()
+            if entry[1] is not None:
+                continue
+            for tagPath in cachedPaths(mapEntry.getKey()):
+                since = sinceByKey.get(historyPathKey(tagPath))
+                if since is not None and entry[3] >= since:
+                    cache['cells'] -= entry[2]
+                    iterator.remove()
+                    break
+    finally:
+        cache['lock'].unlock()
+
+def cacheKeyPart(value):
+    """
+    Converts a query argument into a hashable, value-comparable cache key part.
+    """
+    if isinstance(value, Date):
+        return value.getTime()
+    if isinstance(value, (list, tuple)):
+        return tuple(cacheKeyPart(item) for item in value)
+    return value
+
+def cachedQuery(functionName, queryFunction, args, kwargs, endDate, timeoutMillis=None):
+    """
+    Runs a historian query through the shared cache.
+    Windows that ended more than LATE_DATA_HORIZON_MILLIS ago are treated as immutable
+    and stay cached until evicted or invalidated (invalidateCache). Windows ending more
+    recently may still receive late history and live for OPEN_WINDOW_TTL_MILLIS. Open
+    windows, which end now or later, are also keyed without their end time. Least
+    recently used entries are evicted once the cache holds more than CACHE_CELL_BUDGET
+    cells. Concurrent misses on the same key are coalesced into one query, which runs
+    through limitedCall.
+
+    Args:
+        functionName (str): Name of the query, part of the cache key.
+        queryFunction (callable): The system.tag function to call on a miss.
+        args (tuple): Positional arguments of the query.
+        kwargs (dict): Keyword arguments of the query.
+        endDate (Date): End of the queried window, or None for now.
+        timeoutMillis (int, optional): Deadline of the query on a miss.
+    Returns:
+        dataset: The query result.
+    """
+    nowMillis = system.date.now().getTime()
+    endMillis = nowMillis if endDate is None else endDate.getTime()
+    isOpen = endMillis > nowMillis - OPEN_WINDOW_TTL_MILLIS
+    isRecent = endMillis > nowMillis - LATE_DATA_HORIZON_MILLIS
+
+    def keyPart(value):
+        # The end of an open window moves with every call, so it is left out of the key
+        if isOpen and value is endDate:
+            return None
+        return cacheKeyPart(value)
+
+    key = (functionName, tuple(keyPart(arg) for arg in args), tuple((name, keyPart(value)) for name, value in sorted(kwargs.items())))
+
+    cache = getCache()
+    cache['lock'].lock()
+    try:
+        entry = cache['entries'].get(key)
+        if entry is not None and (entry[1] is None or entry[1] > nowMillis):
+            cache['hits'] += 1
+            return entry[0]
+        cache['misses'] += 1
+    finally:
+        cache['lock'].unlock()
+
+    # Identical misses from concurrent callers share one historian query
+    result = PerformanceTracking.v4.singleFlight.do(key, lambda: limitedCall(lambda: queryFunction(*args, **kwargs), timeoutMillis))
+    if result is None:
+        return result
+
+    cells = max(result.getRowCount() * result.getColumnCount(), 1)
+    if cells > CACHE_CELL_BUDGET:
+        return result
+    expiry = nowMillis + OPEN_WINDOW_TTL_MILLIS if isRecent else None
+
+    cache['lock'].lock()
+    try:
+        entries = cache['entries']
+        previous = entries.put(key, [result, expiry, cells, endMillis])
+        cache['cells'] += cells - (previous[2] if previous is not None else 0)
+        iterator = entries.values().iterator()
+        while cache['cells'] > CACHE_CELL_BUDGET and iterator.hasNext():
+            cache['cells'] -= iterator.next()[2]
+            iterator.remove()
+    finally:
+        cache['lock'].unlock()
+    return result
+
+def queryTagHistory(timeoutMillis=None, **kwargs):
+    """
+    Cached, concurrency-limited front for system.tag.queryTagHistory.
+    Takes the same keyword arguments, plus an optional per-call deadline.
+
+    Returns:
+        dataset: The tag history.
+    """
+    return cachedQuery('queryTagHistory', system.tag.queryTagHistory, (), kwargs, kwargs.get('endDate'), timeoutMillis)
+
+def queryTagCalculations(paths, calculations, startDate=None, endDate=None, timeoutMillis=None, **kwargs):
+    """
+    Cached, concurrency-limited front for system.tag.queryTagCalculations.
+    Takes the same arguments, plus an optional per-call deadline.
+
+    Returns:
+        dataset: One row per path, one column per calculation after the path column.
+    """
+    return cachedQuery('queryTagCalculations', system.tag.queryTagCalculations, (paths, calculations, startDate, endDate), kwargs, endDate, timeoutMillis)
+
+def queryCalculationsByPath(paths, calculations, startDate, endDate, timeoutMillis=None):
+    """
+    Runs every calculation for every path in one queryTagCalculations call and indexes
+    the result by path.
+
+    Args:
+        paths (list): Tag paths, e.g. the Cycle Done, Machine Idle and In Cycle tags of every machine.
+        calculations (list): Calculations such as ["CountOn", "DurationOn"].
+        startDate (Date): Window start.
+        endDate (Date): Window end.
+        timeoutMillis (int, optional): Deadline of the call.
+    Returns:
+        dict: Tag path -> {calculation: value}.
+    """
+    try:
+        if not paths:
+            return {}
+        dataSet = queryTagCalculations(paths, calculations, startDate, endDate, timeoutMillis)
+        results = {}
+        for row in range(len(paths)):
+            results[paths[row]] = dict((calculations[i], dataSet.getValueAt(row, i + 1)) for i in range(len(calculations)))
+        return results
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in queryCalculationsByPath: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/historian.queryCalculationsByPath', 'Error2': 'Error running batched tag calculations', 'Error3': str(e)})
+
+def historyPathKey(tagPath):
+    """
+    Normalizes a tag path as a Tall history result reports it, so it can be matched
+    with the path that was queried: the tag part of a qualified historical path, without
+    the provider, in lower case.
+    """
+    tagPath = str(tagPath)
+    if 'tag:' in tagPath:
+        tagPath = tagPath.split('tag:', 1)[1]
+    elif tagPath.startswith('['):
+        tagPath = tagPath.split(']', 1)[1]
+    return tagPath.lower()
+
+def clampRows(rows, startDate, endDate):
+    """
+    Fits the rows of a history queried with includeBoundingValues to its window.
+    The last sample before the start becomes the value at the start, unless a sample
+    was stored exactly at the start, and samples after the end are dropped.
+
+    Args:
+        rows (list): [timestamp, value] rows in time order.
+        startDate (Date): Window start.
+        endDate (Date): Window end.
+    Returns:
+        list: The rows inside the window.
+    """
+    startMillis, endMillis = startDate.getTime(), endDate.getTime()
+    clamped = []
+    for timestamp, value in rows:
+        millis = timestamp.getTime()
+        if millis > endMillis:
+            break
+        if millis < startMillis:
+            clamped = [[startDate, value]]
+            continue
+        if millis == startMillis and clamped and clamped[-1][0] is startDate:
+            clamped = []
+        clamped.append([timestamp, value])
+    return clamped
+
+def clampHistory(rawDataSet, startDate, endDate):
+    """
+    Fits a single path Wide history queried with includeBoundingValues to its window,
+    as clampRows does.
+
+    Args:
+        rawDataSet (dataset): Wide history with the columns t_stamp and value.
+        startDate (Date): Window start.
+        endDate (Date): Window end.
+    Returns:
+        dataset: The history, starting with the value at the window start when it has one.
+    """
+    headers = [rawDataSet.getColumnName(col) for col in range(rawDataSet.getColumnCount())]
+    rows = [[rawDataSet.getValueAt(row, 0), rawDataSet.getValueAt(row, 1)] for row in range(rawDataSet.getRowCount())]
+    return toDataSet(headers, clampRows(rows, startDate, endDate))
+
+def splitHistoryByPath(rawDataSet, tagPaths, startDate=None, endDate=None):
+    """
+    Splits a multi path Tall history dataset into one dataset per tag path.
+
+    Args:
+        rawDataSet (dataset): Tall dataset returned by queryTagHistory (path, value, quality, timestamp).
+        tagPaths (list): The queried tag paths.
+        startDate (Date, optional): Window start of a query made with includeBoundingValues;
+            each history is then fitted to the window with clampRows.
+        endDate (Date, optional): Window end of that query.
+    Returns:
+        dict: Tag path -> dataset with the columns t_stamp and value, in time order.
+    """
+    byKey = dict((historyPathKey(tagPath), []) for tagPath in tagPaths)
+    pathIndex = rawDataSet.getColumnIndex("path")
+    valueIndex = rawDataSet.getColumnIndex("value")
+    timeIndex = rawDataSet.getColumnIndex("timestamp")
+    for row in range(rawDataSet.getRowCount()):
+        rows = byKey.get(historyPathKey(rawDataSet.getValueAt(row, pathIndex)))
+        value = rawDataSet.getValueAt(row, valueIndex)
+        if rows is not None and value is not None:
+            rows.append([rawDataSet.getValueAt(row, timeIndex), value])
+
+    historyByPath = {}
+    for tagPath in tagPaths:
+        rows = byKey[historyPathKey(tagPath)]
+        rows.sort(key=lambda row: row[0].getTime())
+        if startDate is not None:
+            rows = clampRows(rows, startDate, endDate)
+        historyByPath[tagPath] = toDataSet(["t_stamp", "value"], rows)
+    return historyByPath
+
+def queryHistoryByPath(tagPaths, startDate, endDate):
+    """
+    Reads the raw history of many tags with one Tall query and splits it per tag.
+    A Tall result only holds the samples each tag really has, where a Wide result would
+    hold a cell for every tag at every timestamp of any tag. Bounding values are included,
+    so each tag's history starts with its value at the window start.
+
+    Args:
+        tagPaths (list): Tag paths.
+        startDate (Date): Window start.
+        endDate (Date): Window end.
+    Returns:
+        dict: Tag path -> dataset shaped like a single path Wide query (t_stamp, value).
+    """
+    try:
+        if not tagPaths:
+            return {}
+        rawDataSet = queryTagHistory(paths=tagPaths, startDate=startDate, endDate=endDate, returnSize=-1, noInterpolation=True, includeBoundingValues=True, returnFormat='Tall')
+        return splitHistoryByPath(rawDataSet, tagPaths, startDate, endDate)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in queryHistoryByPath: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/historian.queryHistoryByPath', 'Error2': 'Error running batched tag history', 'Error3': str(e)})
+
+def iterHistory(tagPath, start, end, chunkMinutes=DEFAULT_CHUNK_MINUTES, includePriorValue=True):
+    """
+    Walks the raw history of a tag in fixed-size time chunks and yields its samples.
+    Only one chunk is held in memory at a time, so long windows such as weekly or monthly
+    report re-runs are read with bounded memory. The chunks go through limitedCall but
+    not through the shared cache, so a long re-run cannot evict the live shift entries.
+    Errors are raised to the consumer.
+
+    Args:
+        tagPath (str): Path of the tag.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+        chunkMinutes (int): Width of each historian query in minutes.
+        includePriorValue (bool): Yield the value at the window start first. The first chunk
+            is then queried with includeBoundingValues.
+    Yields:
+        tuple: (timestamp, value) pairs in time order.
+    """
+    chunkStart = start
+    while system.date.isBefore(chunkStart, end):
+        chunkEnd = system.date.addMinutes(chunkStart, chunkMinutes)
+        if system.date.isAfter(chunkEnd, end):
+            chunkEnd = end
+        lastChunk = not system.date.isBefore(chunkEnd, end)
+
+        bounded = includePriorValue and chunkStart is start
+        rawDataSet = limitedCall(lambda: system.tag.queryTagHistory(paths=[tagPath], startDate=chunkStart, endDate=chunkEnd, returnSize=-1, noInterpolation=True, includeBoundingValues=bounded, returnFormat='Tall'))
+        valueIndex = rawDataSet.getColumnIndex("value")
+        timeIndex = rawDataSet.getColumnIndex("timestamp")
+        rows = [[rawDataSet.getValueAt(row, timeIndex), rawDataSet.getValueAt(row, valueIndex)] for row in range(rawDataSet.getRowCount())]
+        if bounded:
+            rows = clampRows(rows, start, chunkEnd)
+        for timestamp, value in rows:
+            # Chunks are half open so a sample on a boundary is only yielded once
+            if system.date.isBefore(timestamp, chunkStart):
+                continue
+            if not lastChunk and not system.date.isBefore(timestamp, chunkEnd):
+                continue
+            yield timestamp, value
+
+        rawDataSet = None
+        chunkStart = chunkEnd
+
+def accumulateOnState(samples, start, end):
+    """
+    Folds a stream of samples into the CountOn and DurationOn of a boolean state.
+    A first sample at or before the window start only sets the initial state; it is
+    not counted as a transition.
+
+    Args:
+        samples (iterable): (timestamp, value) pairs in time order, such as iterHistory yields.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+    Returns:
+        tuple: (countOn, durationOn) with durationOn in seconds.
+    """
+    startMillis = start.getTime()
+    endMillis = end.getTime()
+    countOn = 0
+    durationMillis = 0
+    lastOn = False
+    lastMillis = startMillis
+    seen = False
+
+    for timestamp, value in samples:
+        millis = min(max(timestamp.getTime(), startMillis), endMillis)
+        isOn = bool(value)
+        if lastOn:
+            durationMillis += millis - lastMillis
+        if isOn and not lastOn and (seen or millis > startMillis):
+            countOn += 1
+        lastOn = isOn
+        lastMillis = millis
+        seen = True
+
+    if lastOn:
+        durationMillis += endMillis - lastMillis
+    return countOn, durationMillis / 1000.0
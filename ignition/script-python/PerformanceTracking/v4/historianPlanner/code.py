@@ -0,0 +1,103 @@
+import threading
+import system
+
+# Plan whose histories serve the shift state reads on the current thread
+ACTIVE_PLAN = threading.local()
+
+
+def newPlan():
+    """
+    Creates an empty historian query plan for one cycle.
+
+    Returns:
+        dict: The plan. Requests are added with requestHistory and sent to the
+            historian with execute.
+    """
+    return {'histories': [], 'results': {}, 'requested': 0, 'backendCalls': 0}
+
+def requestHistory(plan, tagPath, start, end):
+    """
+    Adds a history request to the plan. The result is seeded with the value at the
+    window start, as historian.queryHistoryByPath returns it.
+
+    Args:
+        plan (dict): The plan.
+        tagPath (str): Path of the tag.
+        start (Date): Window start.
+        end (Date): Window end.
+    """
+    plan['histories'].append((tagPath, start, end))
+    plan['requested'] += 1
+
+def groupByWindow(requests):
+    """
+    Groups (tagPath, start, end) requests by their window.
+
+    Returns:
+        dict: (startMillis, endMillis) -> [start, end, tagPaths].
+    """
+    groups = {}
+    for tagPath, start, end in requests:
+        group = groups.setdefault((start.getTime(), end.getTime()), [start, end, []])
+        if tagPath not in group[2]:
+            group[2].append(tagPath)
+    return groups
+
+def execute(plan):
+    """
+    Sends the pending requests to the historian with as few calls as possible: all
+    histories over the same window become one historian.queryHistoryByPath call.
+
+    Args:
+        plan (dict): The plan.
+    Returns:
+        dict: The plan, with its results filled in.
+    """
+    try:
+        results = plan['results']
+        for (startMillis, endMillis), (start, end, paths) in groupByWindow(plan['histories']).items():
+            historyByPath = PerformanceTracking.v4.historian.queryHistoryByPath(paths, start, end) or {}
+            # One history call, bounding values included
+            plan['backendCalls'] += 1
+            for tagPath in paths:
+                results[('history', tagPath, startMillis, endMillis)] = historyByPath.get(tagPath)
+
+        plan['histories'] = []
+        return plan
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in execute: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/historianPlanner.execute', 'Error2': 'Error executing historian query plan', 'Error3': str(e)})
+
+def getHistory(plan, tagPath, start, end):
+    """
+    Returns a planned history, or None when it was not planned.
+    """
+    return plan['results'].get(('history', tagPath, start.getTime(), end.getTime()))
+
+def activate(plan):
+    """
+    Makes the plan serve the shift state reads on this thread (updateSCADAtags.getMachineStates).
+    """
+    ACTIVE_PLAN.plan = plan
+
+def deactivate():
+    """
+    Stops serving calls on this thread from a plan.
+    """
+    ACTIVE_PLAN.plan = None
+
+def getActivePlan():
+    """
+    Returns the plan active on this thread, or None.
+    """
+    return getattr(ACTIVE_PLAN, 'plan', None)
+
+def getStats(plan):
+    """
+    Reports how many historian calls the plan saved.
+
+    Returns:
+        dict: 'requested', 'backendCalls' and 'saved'.
+    """
+    return {'requested': plan['requested'], 'backendCalls': plan['backendCalls'], 'saved': plan['requested'] - plan['backendCalls']}
@@ -0,0 +1,279 @@
+import re
+import system
+
+# Database connection of the tag historian
+HISTORIAN_DATABASE = 'Historian'
+# Quality code of good samples in the partition tables
+GOOD_QUALITY = 192
+
+PARTITION_NAME_PATTERN = re.compile(r'^sqlt_data_\w+$')
+
+PARTITIONS_QUERY = """
+SELECT p.pname, p.start_time, p.end_time
+FROM sqlth_partitions p
+JOIN sqlth_drv drv ON drv.id = p.drvid
+WHERE LOWER(drv.provider) = ?
+ORDER BY p.start_time
+"""
+
+# How many partitions before the window are searched for the value active at the
+# window start. Partitions are monthly by default, so this looks back a year.
+MAX_PRIOR_PARTITIONS = 12
+
+# Which of the requested tags have a good sample before the window start in one partition
+PRIOR_SAMPLES_QUERY = """
+SELECT DISTINCT LOWER(te.tagpath)
+FROM {partition} d
+JOIN sqlth_te te ON te.id = d.tagid
+JOIN sqlth_scinfo sc ON sc.id = te.scid
+JOIN sqlth_drv drv ON drv.id = sc.drvid
+WHERE LOWER(drv.provider) = ?
+  AND LOWER(te.tagpath) IN ({tagPathParams})
+  AND d.dataintegrity = {goodQuality}
+  AND d.t_stamp < ?
+"""
+
+# Samples of the requested tags before the window end. Samples before the window start
+# are kept so LAG can see the value that was active when the window opened.
+SAMPLES_CTE = """
+samples AS (
+    SELECT LOWER(te.tagpath) AS tagpath, d.t_stamp AS t_stamp, {valueExpression} AS value
+    FROM ({partitions}) d
+    JOIN sqlth_te te ON te.id = d.tagid
+    JOIN sqlth_scinfo sc ON sc.id = te.scid
+    JOIN sqlth_drv drv ON drv.id = sc.drvid
+    WHERE LOWER(drv.provider) = ?
+      AND LOWER(te.tagpath) IN ({tagPathParams})
+      AND d.dataintegrity = {goodQuality}
+      AND d.t_stamp < ?
+)"""
+
+PARTITION_SELECT = "SELECT tagid, intvalue, floatvalue, stringvalue, dataintegrity, t_stamp FROM {partition}"
+
+# Recipe values as text. MySQL only casts to CHAR, which other databases pad to a fixed width.
+RECIPE_VALUE = "COALESCE(d.stringvalue, CAST(d.intvalue AS VARCHAR(255)), CAST(d.floatvalue AS VARCHAR(255)))"
+MYSQL_RECIPE_VALUE = "COALESCE(d.stringvalue, CAST(d.intvalue AS CHAR), CAST(d.floatvalue AS CHAR))"
+# State values are only compared to 0, which works for integer and float samples alike
+STATE_VALUE = "COALESCE(d.intvalue, d.floatvalue)"
+
+# One row per recipe run: consecutive repeats are dropped with LAG, run ends come
+# from LEAD and runs are clipped to the window.
+RECIPE_RUNS_QUERY = """
+WITH {samples},
+changes AS (
+    SELECT tagpath, t_stamp, value
+    FROM (
+        SELECT tagpath, t_stamp, value,
+               LAG(value) OVER (PARTITION BY tagpath ORDER BY t_stamp) AS prevValue
+        FROM samples
+        WHERE value IS NOT NULL
+    ) c
+    WHERE prevValue IS NULL OR prevValue <> value
+),
+runs AS (
+    SELECT tagpath, value, t_stamp AS runStart,
+           LEAD(t_stamp) OVER (PARTITION BY tagpath ORDER BY t_stamp) AS runEnd
+    FROM changes
+)
+SELECT tagpath, value,
+       CASE WHEN runStart < ? THEN ? ELSE runStart END AS runStart,
+       COALESCE(runEnd, ?) AS runEnd
+FROM runs
+WHERE runEnd IS NULL OR runEnd > ?
+ORDER BY tagpath, runStart
+"""
+
+# CountOn and DurationOn of boolean state tags. Each sample holds until the next one
+# (LEAD); segments are clipped to the window. Rising edges are counted with LAG.
+STATE_CALCULATIONS_QUERY = """
+WITH {samples},
+edges AS (
+    SELECT tagpath, t_stamp, value,
+           LAG(value) OVER (PARTITION BY tagpath ORDER BY t_stamp) AS prevValue,
+           LEAD(t_stamp) OVER (PARTITION BY tagpath ORDER BY t_stamp) AS nextStamp
+    FROM samples
+),
+clipped AS (
+    SELECT tagpath, t_stamp, value, prevValue,
+           CASE WHEN t_stamp < ? THEN ? ELSE t_stamp END AS segStart,
+           CASE WHEN nextStamp IS NULL OR nextStamp > ? THEN ? ELSE nextStamp END AS segEnd
+    FROM edges
+)
+SELECT tagpath,
+       SUM(CASE WHEN value <> 0 AND t_stamp >= ? AND (prevValue = 0 OR (prevValue IS NULL AND t_stamp > ?)) THEN 1 ELSE 0 END) AS countOn,
+       SUM(CASE WHEN value <> 0 AND segEnd > segStart THEN segEnd - segStart ELSE 0 END) AS durationOnMillis
+FROM clipped
+GROUP BY tagpath
+"""
+
+
+def prepQueryRunner(database=HISTORIAN_DATABASE, timeoutMillis=None):
+    """
+    Returns a query runner over system.db.runPrepQuery for the given connection. Each
+    query takes a slot of the historian client, so SQL reads share its concurrency limit
+    and deadline with the tag history queries.
+    Any function taking (query, args) and returning indexable rows can stand in for it,
+    such as a sqlite3 connection seeded with historian-shaped tables.
+    """
+    return lambda query, args: PerformanceTracking.v4.historian.limitedCall(lambda: system.db.runPrepQuery(query, args, database), timeoutMillis)
+
+def getDatabaseType(database=HISTORIAN_DATABASE):
+    """
+    Returns the type of a database connection as Ignition reports it, such as 'MYSQL',
+    'POSTGRES' or 'MSSQL', or None when the connection is unknown.
+    """
+    info = system.db.getConnectionInfo(database)
+    if info.getRowCount() == 0:
+        return None
+    return str(info.getValueAt(0, "DBType")).upper()
+
+def splitTagPath(tagPath):
+    """
+    Splits a tag path into the provider and path as the historian stores them.
+
+    Args:
+        tagPath (str): Tag path such as '[SCADA Overview]Performance Tracking/...'.
+    Returns:
+        tuple: (provider, path), both lower case.
+    """
+    provider, path = '', tagPath
+    if tagPath.startswith('['):
+        provider, path = tagPath[1:].split(']', 1)
+    return provider.lower(), path.lower()
+
+def getPartitions(provider, paths, startMillis, endMillis, runQuery):
+    """
+    Lists the partition tables covering the window, plus the earlier ones holding the
+    value active at the window start. A tag that has not changed for a while has its
+    last sample several partitions back, so partitions starting before the window are
+    searched newest first until every tag has a sample before the window start, or
+    MAX_PRIOR_PARTITIONS earlier partitions have been searched.
+
+    Args:
+        provider (str): Tag provider, lower case.
+        paths (list): Historian tag paths, lower case.
+        startMillis (long): Window start in epoch milliseconds.
+        endMillis (long): Window end in epoch milliseconds.
+        runQuery (callable): Query runner taking (query, args).
+    Returns:
+        list: Partition table names in time order.
+    """
+    partitions = []
+    earlier = []
+    for row in runQuery(PARTITIONS_QUERY, [provider]):
+        name, partitionStart, partitionEnd = row[0], row[1], row[2]
+        if not PARTITION_NAME_PATTERN.match(name):
+            raise ValueError("Unexpected partition table name: " + name)
+        if partitionEnd <= startMillis:
+            earlier.append(name)
+        elif partitionStart < endMillis:
+            partitions.append(name)
+            if partitionStart < startMillis:
+                earlier.append(name)
+
+    pending = set(paths)
+    searched = 0
+    for name in reversed(earlier):
+        if not pending:
+            break
+        if name not in partitions:
+            if searched == MAX_PRIOR_PARTITIONS:
+                break
+            searched += 1
+            partitions.insert(0, name)
+        query = PRIOR_SAMPLES_QUERY.format(partition=name, tagPathParams=", ".join(["?"] * len(pending)), goodQuality=GOOD_QUALITY)
+        for row in runQuery(query, [provider] + list(pending) + [startMillis]):
+            pending.discard(row[0])
+    return partitions
+
+def buildQuery(template, valueExpression, partitions, tagPathCount):
+    """
+    Fills a query template with the samples CTE over the given partitions.
+    """
+    partitionUnion = " UNION ALL ".join(PARTITION_SELECT.format(partition=partition) for partition in partitions)
+    samples = SAMPLES_CTE.format(valueExpression=valueExpression, partitions=partitionUnion, tagPathParams=", ".join(["?"] * tagPathCount), goodQuality=GOOD_QUALITY)
+    return template.format(samples=samples)
+
+def groupTagPaths(tagPaths):
+    """
+    Groups tag paths by provider, so each provider is read with one query.
+
+    Returns:
+        dict: provider -> list of (tagPath, historian path).
+    """
+    byProvider = {}
+    for tagPath in tagPaths:
+        provider, path = splitTagPath(tagPath)
+        byProvider.setdefault(provider, []).append((tagPath, path))
+    return byProvider
+
+def getRecipeRuns(tagPaths, start, end, runQuery=None, databaseType=None):
+    """
+    Computes recipe runs for many recipe tags on the database server.
+
+    Args:
+        tagPaths (list): Recipe tag paths.
+        start (Date): Window start.
+        end (Date): Window end.
+        runQuery (callable, optional): Query runner; prepQueryRunner() by default.
+        databaseType (str, optional): Type of the database runQuery reads, as getDatabaseType
+            returns it; read from HISTORIAN_DATABASE when runQuery is omitted.
+    Returns:
+        dict: Tag path -> list of (recipe, runStartMillis, runEndMillis) in time order.
+    """
+    try:
+        if runQuery is None:
+            runQuery = prepQueryRunner()
+            if databaseType is None:
+                databaseType = getDatabaseType()
+        recipeValue = MYSQL_RECIPE_VALUE if databaseType == 'MYSQL' else RECIPE_VALUE
+        startMillis, endMillis = start.getTime(), end.getTime()
+        runs = dict((tagPath, []) for tagPath in tagPaths)
+
+        for provider, paths in groupTagPaths(tagPaths).items():
+            byPath = dict((path, tagPath) for tagPath, path in paths)
+            partitions = getPartitions(provider, byPath.keys(), startMillis, endMillis, runQuery)
+            if not partitions:
+                continue
+            query = buildQuery(RECIPE_RUNS_QUERY, recipeValue, partitions, len(byPath))
+            args = [provider] + list(byPath.keys()) + [endMillis, startMillis, startMillis, endMillis, startMillis]
+            for row in runQuery(query, args):
+                runs[byPath[row[0]]].append((row[1], long(row[2]), long(row[3])))
+        return runs
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getRecipeRuns: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/historianSQL.getRecipeRuns', 'Error2': 'Error computing recipe runs in the historian database', 'Error3': str(e)})
+
+def getStateCalculations(tagPaths, start, end, runQuery=None):
+    """
+    Computes CountOn and DurationOn for many boolean state tags on the database server.
+
+    Args:
+        tagPaths (list): State tag paths, such as Cycle Done, Machine Idle and In Cycle.
+        start (Date): Window start.
+        end (Date): Window end.
+        runQuery (callable, optional): Query runner; prepQueryRunner() by default.
+    Returns:
+        dict: Tag path -> (countOn, durationOn) with durationOn in seconds.
+    """
+    try:
+        if runQuery is None:
+            runQuery = prepQueryRunner()
+        startMillis, endMillis = start.getTime(), end.getTime()
+        calculations = dict((tagPath, (0, 0.0)) for tagPath in tagPaths)
+
+        for provider, paths in groupTagPaths(tagPaths).items():
+            byPath = dict((path, tagPath) for tagPath, path in paths)
+            partitions = getPartitions(provider, byPath.keys(), startMillis, endMillis, runQuery)
+            if not partitions:
+                continue
+            query = buildQuery(STATE_CALCULATIONS_QUERY, STATE_VALUE, partitions, len(byPath))
+            args = [provider] + list(byPath.keys()) + [endMillis, startMillis, startMillis, endMillis, endMillis, startMillis, startMillis]
+            for row in runQuery(query, args):
+                calculations[byPath[row[0]]] = (int(row[1] or 0), (row[2] or 0) / 1000.0)
+        return calculations
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getStateCalculations: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/historianSQL.getStateCalculations', 'Error2': 'Error computing state durations in the historian database', 'Error3': str(e)})
@@ -74,7 +74,7 @@ def retrieveRecipeRunDataFromDB(machineUniqueName, start, end):
         'StartTime': start,
         'EndTime': end
     }
-    return system.db.runNamedQuery("SCADA_Overview/RetrieveRecipeRunData", params)
+    return PerformanceTracking.v4.singleFlight.runNamedQuery("SCADA_Overview/RetrieveRecipeRunData", params)
 
 def getMaxEndTime(dataset):
     """
@@ -86,19 +86,14 @@ def getMaxEndTime(dataset):
     Returns:
         str: The maximum 'End Time' as a string.
     """
-    maxEndTime = None
-    for row in range(dataset.getRowCount()):
-        endTime = dataset.getValueAt(row, "End Time")
-        if maxEndTime is None or endTime > maxEndTime:
-            maxEndTime = endTime
-    return maxEndTime
+    return PerformanceTracking.v4.datasetColumns.columnMax(dataset, "End Time")
 
 def main(rootTagPath, machineName, start, end):
 	machineUniqueName = rootTagPath.replace("[SCADA Overview]Performance Tracking/", "").rstrip("/")
 	print('Querying DB for Runs for ' + machineUniqueName + ' during ' + str(start) + ' to ' + str(end))
 	recipeRunsFromDB = retrieveRecipeRunDataFromDB(machineUniqueName, start, end)
 	maxEndTime = getMaxEndTime(recipeRunsFromDB)
-	print "\nRetreived info from database
+	print "\nRetreived info from database"
 	Utility.printAsTable(recipeRunsFromDB)
 	
 	print("\nMaximum End Time:", maxEndTime)
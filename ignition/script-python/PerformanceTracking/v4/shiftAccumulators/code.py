@@ -0,0 +1,158 @@
+import system
+from java.util import Date
+from java.util.concurrent import ConcurrentHashMap
+from java.util.concurrent.locks import ReentrantLock
+
+# Shift-to-date totals per tag, kept in the gateway globals between timer runs
+ACCUMULATOR_GLOBALS_KEY = 'PerformanceTracking.v4.shiftAccumulators'
+# Lock guarding every change to the accumulators, kept next to them
+ACCUMULATOR_LOCK_GLOBALS_KEY = 'PerformanceTracking.v4.shiftAccumulatorsLock'
+
+
+def getAccumulators():
+    """
+    Returns the gateway-wide map of tag path -> accumulator.
+    An accumulator is a dict with 'shiftStart' and 'lastEnd' in epoch milliseconds,
+    'countOn', 'durationOn' (seconds), 'state', the value of the tag at lastEnd,
+    'seeded', set once state is known, and 'checkpoints', (lastEnd, countOn, durationOn,
+    state) tuples of earlier advances that a reconciliation can roll back to.
+    """
+    globalVars = system.util.getGlobals()
+    accumulators = globalVars.get(ACCUMULATOR_GLOBALS_KEY)
+    if accumulators is None:
+        accumulators = globalVars.setdefault(ACCUMULATOR_GLOBALS_KEY, ConcurrentHashMap())
+    return accumulators
+
+def getLock():
+    """
+    Returns the gateway-wide lock of the accumulators, creating it on first use.
+    """
+    globalVars = system.util.getGlobals()
+    lock = globalVars.get(ACCUMULATOR_LOCK_GLOBALS_KEY)
+    if lock is None:
+        lock = globalVars.setdefault(ACCUMULATOR_LOCK_GLOBALS_KEY, ReentrantLock())
+    return lock
+
+def newAccumulator(shiftStartMillis):
+    """
+    Returns an accumulator that still has to read its tag from the shift start.
+    """
+    return {'shiftStart': shiftStartMillis, 'lastEnd': shiftStartMillis, 'countOn': 0, 'durationOn': 0.0, 'state': None, 'seeded': False, 'checkpoints': []}
+
+def rewind(accumulator, sinceMillis):
+    """
+    Rolls an accumulator back to its last checkpoint at or before sinceMillis, so the
+    history after it is read again and its totals are replaced by the re-read ones.
+    Without such a checkpoint the accumulator restarts from the shift start.
+    """
+    checkpoints = accumulator.setdefault('checkpoints', [])
+    while checkpoints and checkpoints[-1][0] > sinceMillis:
+        checkpoints.pop()
+    if not checkpoints:
+        accumulator.update(newAccumulator(accumulator['shiftStart']))
+        return
+    accumulator['lastEnd'], accumulator['countOn'], accumulator['durationOn'], accumulator['state'] = checkpoints[-1]
+    accumulator['seeded'] = True
+
+def resetAccumulators():
+    """
+    Drops every accumulator, so the next advance recomputes from the shift start.
+    """
+    lock = getLock()
+    lock.lock()
+    try:
+        getAccumulators().clear()
+    finally:
+        lock.unlock()
+
+def advance(tagPaths, shiftStart, now, reconcileMinutes=None):
+    """
+    Brings the shift-to-date CountOn and DurationOn of boolean tags up to now.
+    Tags already accumulated this shift only read [lastEnd, now]; their state at
+    lastEnd seeds the delta, so a state spanning the boundary adds its remaining
+    duration and is not counted again. Tags seen for the first time, or after the
+    shift changed, are read from the shift start with bounding values, which give
+    their state at the shift start.
+    With reconcileMinutes, each tag first rolls back to its checkpoint at or before
+    that many minutes ago (rewind), so samples that arrived late through
+    store-and-forward replace what was added for that trailing window.
+    Tags sharing a window are read with one history query.
+    Overlapping runs, such as a manual run during a timer run, are safe: the accumulators
+    are only changed under their lock, and a delta is only added while the tag's lastEnd
+    is still the start of the window it was read for. A run that lost the race leaves the
+    tag to the run that won, so no delta is added twice.
+
+    Args:
+        tagPaths (list): Boolean tag paths, such as every machine's Cycle Done, Machine Idle and In Cycle.
+        shiftStart (Date): Start of the current shift.
+        now (Date): End of the window.
+        reconcileMinutes (int, optional): Trailing window to read again.
+    Returns:
+        dict: Tag path -> (countOn, durationOn) for the shift to date, durationOn in seconds.
+    """
+    try:
+        accumulators = getAccumulators()
+        shiftStartMillis = shiftStart.getTime()
+        nowMillis = now.getTime()
+        reconcileStartMillis = nowMillis - reconcileMinutes * 60000 if reconcileMinutes else None
+
+        lock = getLock()
+
+        # Group the tags by the start of the window they still need
+        byWindowStart = {}
+        lock.lock()
+        try:
+            for tagPath in tagPaths:
+                accumulator = accumulators.get(tagPath)
+                if accumulator is None or accumulator['shiftStart'] != shiftStartMillis or accumulator['lastEnd'] > nowMillis:
+                    accumulator = newAccumulator(shiftStartMillis)
+                    accumulators.put(tagPath, accumulator)
+                elif reconcileStartMillis is not None and accumulator['lastEnd'] > reconcileStartMillis:
+                    rewind(accumulator, reconcileStartMillis)
+                byWindowStart.setdefault((accumulator['lastEnd'], accumulator['seeded']), []).append((tagPath, accumulator, accumulator['state']))
+        finally:
+            lock.unlock()
+
+        # The history is read without holding the lock
+        for (windowStartMillis, seeded), entries in byWindowStart.items():
+            windowStart = Date(windowStartMillis)
+            paths = [tagPath for tagPath, accumulator, state in entries]
+            # Unseeded tags take their state at the window start from the bounding values
+            rawDataSet = PerformanceTracking.v4.historian.queryTagHistory(paths=paths, startDate=windowStart, endDate=now, returnSize=-1, noInterpolation=True, includeBoundingValues=not seeded, returnFormat='Tall')
+            historyByPath = PerformanceTracking.v4.historian.splitHistoryByPath(rawDataSet, paths, windowStart, now)
+
+            for tagPath, accumulator, state in entries:
+                samples = [(windowStart, state)] if seeded and state is not None else []
+                history = historyByPath[tagPath]
+                samples.extend((history.getValueAt(row, 0), history.getValueAt(row, 1)) for row in range(history.getRowCount()))
+                countOn, durationOn = PerformanceTracking.v4.historian.accumulateOnState(samples, windowStart, now)
+
+                lock.lock()
+                try:
+                    # Another run advanced, rewound or replaced this tag meanwhile
+                    if accumulators.get(tagPath) is not accumulator or accumulator['lastEnd'] != windowStartMillis:
+                        continue
+                    accumulator['countOn'] += countOn
+                    accumulator['durationOn'] += durationOn
+                    accumulator['state'] = samples[-1][1] if samples else None
+                    accumulator['lastEnd'] = nowMillis
+                    accumulator['seeded'] = True
+
+                    # Keep the checkpoints inside the reconciliation window, plus the last one before it
+                    checkpoints = accumulator.setdefault('checkpoints', [])
+                    checkpoints.append((nowMillis, accumulator['countOn'], accumulator['durationOn'], accumulator['state']))
+                    horizonMillis = reconcileStartMillis if reconcileStartMillis is not None else nowMillis
+                    while len(checkpoints) > 1 and checkpoints[1][0] <= horizonMillis:
+                        checkpoints.pop(0)
+                finally:
+                    lock.unlock()
+
+        lock.lock()
+        try:
+            return dict((tagPath, (accumulators.get(tagPath)['countOn'], accumulators.get(tagPath)['durationOn'])) for tagPath in tagPaths)
+        finally:
+            lock.unlock()
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in advance: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/shiftAccumulators.advance', 'Error2': 'Error advancing shift accumulators', 'Error3': str(e)})
@@ -0,0 +1,73 @@
+import sys
+import system
+from java.util.concurrent import Callable, ConcurrentHashMap, FutureTask
+
+# Calls in progress, kept in the gateway globals so timer scripts and Perspective sessions share them
+INFLIGHT_GLOBALS_KEY = 'PerformanceTracking.v4.singleFlight'
+
+
+class OutcomeCallable(Callable):
+    """
+    Runs a Python function for a FutureTask and captures its outcome, so a Python
+    exception can be re-raised unchanged in every waiting caller.
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def call(self):
+        try:
+            return (True, self.function())
+        except:
+            return (False, sys.exc_info())
+
+
+def getInFlight():
+    """
+    Returns the gateway-wide map of key -> FutureTask for calls in progress.
+    """
+    globalVars = system.util.getGlobals()
+    inFlight = globalVars.get(INFLIGHT_GLOBALS_KEY)
+    if inFlight is None:
+        inFlight = globalVars.setdefault(INFLIGHT_GLOBALS_KEY, ConcurrentHashMap())
+    return inFlight
+
+def do(key, function):
+    """
+    Runs function once for all concurrent callers that use the same key.
+    The first caller runs it; callers arriving while it runs wait and share its
+    result or exception. The key is released as soon as the call finishes, so later
+    callers run it again.
+
+    Args:
+        key: Hashable identity of the call, such as a tuple of its arguments.
+        function (callable): Function without arguments that performs the call.
+    Returns:
+        The result of function.
+    """
+    inFlight = getInFlight()
+    task = FutureTask(OutcomeCallable(function))
+    running = inFlight.putIfAbsent(key, task)
+    if running is None:
+        try:
+            task.run()
+        finally:
+            inFlight.remove(key, task)
+        running = task
+
+    succeeded, outcome = running.get()
+    if not succeeded:
+        raise outcome[0], outcome[1], outcome[2]
+    return outcome
+
+def runNamedQuery(queryPath, queryParams):
+    """
+    Coalesced front for system.db.runNamedQuery.
+
+    Args:
+        queryPath (str): Path of the named query.
+        queryParams (dict): Parameters of the named query.
+    Returns:
+        dataset: The query result.
+    """
+    key = ('runNamedQuery', queryPath, tuple(sorted(queryParams.items())))
+    return do(key, lambda: system.db.runNamedQuery(queryPath, queryParams))
@@ -0,0 +1,303 @@
+from bisect import bisect_left, bisect_right
+import system
+
+
+def getOnIntervals(samples, start, end, edges=None):
+    """
+    Turns a stream of boolean samples into the intervals the state was on.
+    Follows accumulateOnState: the state holds from each sample to the next, and the
+    first sample at or before the window start only sets the initial state.
+
+    Args:
+        samples (iterable): (timestamp, value) pairs in time order, such as historian.iterHistory yields.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+        edges (list, optional): Receives the time in milliseconds of every rising edge
+            that CountOn would count.
+    Returns:
+        list: (onStartMillis, onEndMillis) pairs, sorted and disjoint, clipped to the window.
+    """
+    startMillis = start.getTime()
+    endMillis = end.getTime()
+    intervals = []
+    onSince = None
+    seen = False
+
+    for timestamp, value in samples:
+        millis = min(max(timestamp.getTime(), startMillis), endMillis)
+        if value and onSince is None:
+            onSince = millis
+            if edges is not None and (seen or millis > startMillis):
+                edges.append(millis)
+        elif not value and onSince is not None:
+            if millis > onSince:
+                intervals.append((onSince, millis))
+            onSince = None
+        seen = True
+
+    if onSince is not None and endMillis > onSince:
+        intervals.append((onSince, endMillis))
+    return intervals
+
+def fetchSamples(tagPath, start, end):
+    """
+    Reads the raw samples of a tag over a window with a single history query, seeded
+    with the value at the window start.
+
+    Returns:
+        generator: (timestamp, value) pairs in time order.
+    """
+    windowMinutes = max(1, int((end.getTime() - start.getTime() + 59999) / 60000))
+    return PerformanceTracking.v4.historian.iterHistory(tagPath, start, end, windowMinutes)
+
+def fetchOnIntervals(tagPath, start, end):
+    """
+    Reads the on intervals of a boolean tag over a window with a single history query,
+    seeded with the value at the window start.
+
+    Args:
+        tagPath (str): Path of the tag, such as the Machine Idle tag.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+    Returns:
+        list: (onStartMillis, onEndMillis) pairs, as getOnIntervals returns them.
+    """
+    try:
+        return getOnIntervals(fetchSamples(tagPath, start, end), start, end)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in fetchOnIntervals: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/stateIntervals.fetchOnIntervals', 'Error2': 'Error reading state intervals', 'Error3': str(e)})
+
+def overlapByWindow(intervals, windows):
+    """
+    Sums how long the state was on inside each window in one sweep.
+    Windows must be sorted by start; they may touch or overlap. The sweep never moves
+    back past an interval that ended before the current window started, so sorted,
+    non-overlapping windows such as recipe runs cost O(intervals + windows).
+
+    Args:
+        intervals (list): Sorted, disjoint (onStartMillis, onEndMillis) pairs.
+        windows (list): (startMillis, endMillis) pairs sorted by start.
+    Returns:
+        list: On duration in milliseconds for each window, in window order.
+    """
+    durations = []
+    first = 0
+    for windowStart, windowEnd in windows:
+        while first < len(intervals) and intervals[first][1] <= windowStart:
+            first += 1
+        total = 0
+        i = first
+        while i < len(intervals) and intervals[i][0] < windowEnd:
+            total += min(intervals[i][1], windowEnd) - max(intervals[i][0], windowStart)
+            i += 1
+        durations.append(total)
+    return durations
+
+def buildIndex(intervals, edges, start, end):
+    """
+    Builds an interval index answering DurationOn and CountOn for any sub-window of
+    [start, end] in logarithmic time: sorted interval bounds with a running sum of
+    their durations, and the sorted rising edges.
+
+    Args:
+        intervals (list): Sorted, disjoint (onStartMillis, onEndMillis) pairs.
+        edges (list): Sorted rising edge times in milliseconds.
+        start (Date): Start of the window the intervals cover.
+        end (Date): End of the window the intervals cover.
+    Returns:
+        dict: 'start', 'end', 'starts', 'ends', 'prefix' and 'edges'.
+    """
+    prefix = [0]
+    for onStart, onEnd in intervals:
+        prefix.append(prefix[-1] + onEnd - onStart)
+    return {
+        'start': start.getTime(),
+        'end': end.getTime(),
+        'starts': [onStart for onStart, onEnd in intervals],
+        'ends': [onEnd for onStart, onEnd in intervals],
+        'prefix': prefix,
+        'edges': list(edges)
+    }
+
+def indexSamples(samples, start, end):
+    """
+    Indexes a stream of boolean samples, such as the history of a tag or the
+    transitions held in its transitionBuffer.
+
+    Args:
+        samples (iterable): (timestamp, value) pairs in time order, seeded with the value at start.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+    Returns:
+        dict: The index, as buildIndex returns it.
+    """
+    edges = []
+    intervals = getOnIntervals(samples, start, end, edges)
+    return buildIndex(intervals, edges, start, end)
+
+def fetchIndex(tagPath, start, end):
+    """
+    Reads a boolean tag over a window with a single history query and indexes it.
+
+    Args:
+        tagPath (str): Path of the tag, such as a machine's Machine Idle, In Cycle or Cycle Done tag.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+    Returns:
+        dict: The index, as buildIndex returns it.
+    """
+    try:
+        return indexSamples(fetchSamples(tagPath, start, end), start, end)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in fetchIndex: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/stateIntervals.fetchIndex', 'Error2': 'Error building state interval index', 'Error3': str(e)})
+
+def durationOnMillis(index, startMillis, endMillis):
+    """
+    How long the state was on inside [startMillis, endMillis], in milliseconds.
+    The window is clipped to the span the index covers.
+    """
+    startMillis = max(startMillis, index['start'])
+    endMillis = min(endMillis, index['end'])
+    starts, ends, prefix = index['starts'], index['ends'], index['prefix']
+    # Intervals first..last-1 end after the window start and begin before its end
+    first = bisect_right(ends, startMillis)
+    last = bisect_left(starts, endMillis)
+    if first >= last:
+        return 0
+    total = prefix[last] - prefix[first]
+    total -= max(0, startMillis - starts[first])
+    total -= max(0, ends[last - 1] - endMillis)
+    return total
+
+def durationOn(index, start, end):
+    """
+    DurationOn of the indexed state over a sub-window.
+
+    Args:
+        index (dict): The index.
+        start (Date): Start of the sub-window.
+        end (Date): End of the sub-window.
+    Returns:
+        float: Time on in seconds.
+    """
+    return durationOnMillis(index, start.getTime(), end.getTime()) / 1000.0
+
+def countOn(index, start, end):
+    """
+    CountOn of the indexed state over a sub-window. A state already on when the
+    sub-window opens is not counted, as the historian seeds it from the prior value.
+
+    Args:
+        index (dict): The index.
+        start (Date): Start of the sub-window.
+        end (Date): End of the sub-window.
+    Returns:
+        int: Rising edges after the sub-window start, up to and including its end.
+    """
+    edges = index['edges']
+    return max(0, bisect_right(edges, end.getTime()) - bisect_right(edges, start.getTime()))
+
+def bucketWindows(start, end, bucketMinutes=60):
+    """
+    Splits a window into clock-aligned buckets, such as the hours of a shift.
+    The first and last buckets are clipped to the window.
+
+    Args:
+        start (Date): Start of the window.
+        end (Date): End of the window.
+        bucketMinutes (int): Width of each bucket in minutes.
+    Returns:
+        list: (('bucket', bucketStartMillis), startMillis, endMillis) windows in time order.
+    """
+    windows = []
+    bucketStart = system.date.setTime(start, system.date.getHour24(start), 0, 0)
+    while system.date.isBefore(bucketStart, end):
+        bucketEnd = system.date.addMinutes(bucketStart, bucketMinutes)
+        windowStart = max(bucketStart.getTime(), start.getTime())
+        windowEnd = min(bucketEnd.getTime(), end.getTime())
+        if windowEnd > windowStart:
+            windows.append((('bucket', bucketStart.getTime()), windowStart, windowEnd))
+        bucketStart = bucketEnd
+    return windows
+
+def clipToWindows(signals, windows, complement=None, complementIntervals=None):
+    """
+    Clips every signal to every window in a single merge pass over the sorted
+    interval bounds, rising edges and window bounds. The cost grows with the number
+    of events and the windows open at once, not with signals times windows, so hourly
+    buckets and per-run breakdowns cost about the same as one shift total.
+
+    Args:
+        signals (dict): Name -> (intervals, edges), as getOnIntervals fills them. Recipe
+            runs can be passed as signals too, one per recipe, with no edges.
+        windows (list): (key, startMillis, endMillis) windows; they may overlap.
+        complement (tuple, optional): (name, signal names) of a state derived in the same
+            pass, on whenever none of those signals is, such as ('down', ['inCycle', 'idle']).
+        complementIntervals (list, optional): Receives the (startMillis, endMillis)
+            intervals of the derived state inside the windows.
+    Returns:
+        dict: Window key -> signal name -> {'durationOn': milliseconds, 'countOn': rising
+            edges after the window start up to and including its end}. The derived state
+            is reported like a signal, with a countOn of 0.
+    """
+    # Events at the same time are applied in this order: edges are counted by windows
+    # still open, closing windows include their end, opening windows exclude their start,
+    # and a signal turning off and on again stays on
+    EDGE, CLOSE, OPEN, SIGNAL_OFF, SIGNAL_ON = 0, 1, 2, 3, 4
+    events = []
+    for name, (intervals, edges) in signals.items():
+        for onStart, onEnd in intervals:
+            events.append((onStart, SIGNAL_ON, name))
+            events.append((onEnd, SIGNAL_OFF, name))
+        for millis in edges:
+            events.append((millis, EDGE, name))
+    for index in range(len(windows)):
+        key, windowStart, windowEnd = windows[index]
+        if windowEnd <= windowStart:
+            continue
+        events.append((windowStart, OPEN, index))
+        events.append((windowEnd, CLOSE, index))
+    events.sort()
+
+    names = list(signals)
+    complementName, components = complement if complement is not None else (None, [])
+    if complementName is not None:
+        names.append(complementName)
+    results = dict((key, dict((name, {'durationOn': 0, 'countOn': 0}) for name in names)) for key, windowStart, windowEnd in windows)
+    activeSignals = set()
+    openWindows = set()
+    lastMillis = None
+
+    for millis, kind, item in events:
+        if lastMillis is not None and millis > lastMillis and openWindows:
+            elapsed = millis - lastMillis
+            complementOn = complementName is not None and not any(name in activeSignals for name in components)
+            for index in openWindows:
+                windowResults = results[windows[index][0]]
+                for name in activeSignals:
+                    windowResults[name]['durationOn'] += elapsed
+                if complementOn:
+                    windowResults[complementName]['durationOn'] += elapsed
+            if complementOn and complementIntervals is not None:
+                if complementIntervals and complementIntervals[-1][1] == lastMillis:
+                    complementIntervals[-1] = (complementIntervals[-1][0], millis)
+                else:
+                    complementIntervals.append((lastMillis, millis))
+        lastMillis = millis
+
+        if kind == EDGE:
+            for index in openWindows:
+                results[windows[index][0]][item]['countOn'] += 1
+        elif kind == CLOSE:
+            openWindows.discard(item)
+        elif kind == OPEN:
+            openWindows.add(item)
+        elif kind == SIGNAL_OFF:
+            activeSignals.discard(item)
+        else:
+            activeSignals.add(item)
+    return results
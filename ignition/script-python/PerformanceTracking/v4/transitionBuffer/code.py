@@ -0,0 +1,224 @@
+import jarray
+import system
+from java.util import Date
+from java.util.concurrent import ConcurrentHashMap
+from java.util.concurrent.locks import ReentrantLock
+from system.dataset import toDataSet
+
+# Buffers of every machine, kept in the gateway globals so the tag change script and the timer share them
+BUFFER_GLOBALS_KEY = 'PerformanceTracking.v4.transitionBuffers'
+# Transitions held per machine before the oldest are overwritten
+DEFAULT_CAPACITY = 4096
+
+TAG_ROOT = "[SCADA Overview]Performance Tracking/"
+# Buffered tags, relative to the machine root, and their names in updateSCADAtags.createTagPaths
+SIGNALS = {
+    'machineStatus/Cycle Done': 'cycleDone',
+    'machineStatus/In Cycle': 'inCycle',
+    'machineStatus/Machine Idle': 'idle',
+    'Active Recipe': 'activeRecipe'
+}
+SIGNAL_CODES = ['cycleDone', 'inCycle', 'idle', 'activeRecipe']
+
+
+def splitTagPath(tagPath):
+    """
+    Splits a buffered tag path into its machine root and signal name.
+
+    Args:
+        tagPath (str): Full tag path, e.g. '[SCADA Overview]Performance Tracking/<system>/<machine>/machineStatus/Cycle Done'.
+    Returns:
+        tuple: (rootTagPath, signal), or None when the tag is not buffered.
+    """
+    if not tagPath.startswith(TAG_ROOT):
+        return None
+    for suffix, signal in SIGNALS.items():
+        if tagPath.endswith('/' + suffix):
+            return tagPath[:-len(suffix)], signal
+    return None
+
+def getBuffers():
+    """
+    Returns the gateway-wide map of machine root tag path -> buffer.
+    """
+    globalVars = system.util.getGlobals()
+    buffers = globalVars.get(BUFFER_GLOBALS_KEY)
+    if buffers is None:
+        buffers = globalVars.setdefault(BUFFER_GLOBALS_KEY, ConcurrentHashMap())
+    return buffers
+
+def newBuffer(capacity=DEFAULT_CAPACITY):
+    """
+    Creates an empty ring buffer of transitions.
+
+    Returns:
+        dict: 'times', 'signals' and 'values' arrays, 'head' and 'size' of the ring,
+            'baseline' (signal -> (millis, value) known before the oldest entry),
+            'since' (millis from which the buffer is complete) and 'lock'.
+    """
+    return {
+        'times': jarray.zeros(capacity, 'l'),
+        'signals': jarray.zeros(capacity, 'b'),
+        'values': [None] * capacity,
+        'head': 0,
+        'size': 0,
+        'baseline': {},
+        'since': None,
+        'lock': ReentrantLock()
+    }
+
+def lastValue(buffer, signal):
+    """
+    Returns the newest value a buffer holds for a signal. Call with the buffer locked.
+    """
+    code = SIGNAL_CODES.index(signal)
+    capacity = len(buffer['times'])
+    for offset in range(buffer['size'] - 1, -1, -1):
+        index = (buffer['head'] + offset) % capacity
+        if buffer['signals'][index] == code:
+            return buffer['values'][index]
+    return buffer['baseline'][signal][1]
+
+def append(buffer, signal, millis, value):
+    """
+    Appends a transition to the ring, overwriting the oldest one once it is full.
+    Call with the buffer locked.
+    """
+    capacity = len(buffer['times'])
+    if buffer['size'] == capacity:
+        # The oldest transition becomes the baseline of its signal
+        oldest = buffer['head']
+        buffer['baseline'][SIGNAL_CODES[buffer['signals'][oldest]]] = (buffer['times'][oldest], buffer['values'][oldest])
+        buffer['since'] = max(buffer['since'], buffer['times'][oldest])
+        buffer['head'] = (oldest + 1) % capacity
+        buffer['size'] -= 1
+
+    index = (buffer['head'] + buffer['size']) % capacity
+    buffer['times'][index] = millis
+    buffer['signals'][index] = SIGNAL_CODES.index(signal)
+    buffer['values'][index] = value
+    buffer['size'] += 1
+
+def record(tagPath, value, timestamp, initialChange=False):
+    """
+    Records a value of a buffered tag. The first value seen of each signal, such as
+    the initial change of a tag change script, seeds its baseline; later values are
+    appended to the ring, overwriting the oldest transition once it is full.
+    An initial change after a script restart is only recorded when the value moved
+    while the script was not running. Changes in that gap may have been missed, so the
+    buffer then only claims to be complete from the time of that value.
+
+    Args:
+        tagPath (str): Full tag path.
+        value: New value of the tag.
+        timestamp (Date): Time of the change.
+        initialChange (bool): The value is the current one at subscription rather than a change.
+    """
+    parsed = splitTagPath(tagPath)
+    if parsed is None:
+        return
+    rootTagPath, signal = parsed
+    buffers = getBuffers()
+    buffer = buffers.get(rootTagPath)
+    if buffer is None:
+        buffers.putIfAbsent(rootTagPath, newBuffer())
+        buffer = buffers.get(rootTagPath)
+
+    millis = timestamp.getTime()
+    buffer['lock'].lock()
+    try:
+        if signal not in buffer['baseline']:
+            buffer['baseline'][signal] = (millis, value)
+            if buffer['since'] is None or millis > buffer['since']:
+                buffer['since'] = millis
+            return
+        if initialChange:
+            if value == lastValue(buffer, signal):
+                return
+            buffer['since'] = max(buffer['since'], millis)
+        append(buffer, signal, millis, value)
+    finally:
+        buffer['lock'].unlock()
+
+def handleTagChange(event, initialChange):
+    """
+    Entry point for a gateway tag change script subscribed to the Cycle Done, In Cycle,
+    Machine Idle and Active Recipe tags of the machines:
+
+        PerformanceTracking.v4.transitionBuffer.handleTagChange(event, initialChange)
+
+    Args:
+        event (TagChangeEvent): The tag change event.
+        initialChange (bool): The initialChange flag of the script.
+    """
+    try:
+        qualifiedValue = event.getValue()
+        if not qualifiedValue.getQuality().isGood():
+            return
+        record(str(event.getTagPath()), qualifiedValue.getValue(), qualifiedValue.getTimestamp(), initialChange)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in handleTagChange: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/transitionBuffer.handleTagChange', 'Error2': 'Error recording tag transition', 'Error3': str(e)})
+
+def getSamples(rootTagPath, signal, start, end):
+    """
+    Reads the transitions of a signal over a window from its machine's buffer.
+
+    Args:
+        rootTagPath (str): Root tag path of the machine, ending with '/'.
+        signal (str): 'cycleDone', 'inCycle', 'idle' or 'activeRecipe'.
+        start (Date): Start of the window.
+        end (Date): End of the window.
+    Returns:
+        list: (timestamp, value) pairs in time order, starting with the value at start,
+            or None when the buffer does not cover the window.
+    """
+    buffer = getBuffers().get(rootTagPath)
+    if buffer is None:
+        return None
+    startMillis, endMillis = start.getTime(), end.getTime()
+
+    buffer['lock'].lock()
+    try:
+        if signal not in buffer['baseline'] or startMillis < buffer['since']:
+            return None
+        code = SIGNAL_CODES.index(signal)
+        times, signals, values = buffer['times'], buffer['signals'], buffer['values']
+        capacity = len(times)
+        value = buffer['baseline'][signal][1]
+        samples = []
+        for offset in range(buffer['size']):
+            index = (buffer['head'] + offset) % capacity
+            if signals[index] != code:
+                continue
+            if times[index] <= startMillis:
+                value = values[index]
+            elif times[index] <= endMillis:
+                samples.append((Date(times[index]), values[index]))
+        return [(start, value)] + samples
+    finally:
+        buffer['lock'].unlock()
+
+def getMachineSamples(rootTagPath, start, end):
+    """
+    Reads every buffered signal of a machine over a window.
+
+    Returns:
+        dict: Signal -> samples as getSamples returns them, or None unless the buffer
+            covers the window for all signals.
+    """
+    samplesBySignal = {}
+    for signal in SIGNAL_CODES:
+        samples = getSamples(rootTagPath, signal, start, end)
+        if samples is None:
+            return None
+        samplesBySignal[signal] = samples
+    return samplesBySignal
+
+def toRecipeHistory(samples):
+    """
+    Shapes buffered Active Recipe samples like a single path Wide history (t_stamp, value),
+    as getRecipeRunInfo.getRecipeRunsFromHistorian takes it.
+    """
+    return toDataSet(["t_stamp", "value"], [[timestamp, recipe] for timestamp, recipe in samples if recipe is not None])
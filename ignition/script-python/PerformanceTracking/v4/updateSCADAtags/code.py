@@ -50,39 +50,61 @@ def findChildMachines(systemName):
         logger.error("ScriptError in findChildMachines: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.findChildMachines', 'Error2': 'Error finding child machines', 'Error3': str(e)})
 
-def countOn(tagPath, queryStart, queryEnd):
+def countOn(tagPath, queryStart, queryEnd, chunkMinutes=None, backend='tag', stateIndex=None):
     """
     Performs a CountOn query for a specified tag over a shift.
 
     :param tagPath: Path of the tag
     :param queryStart: Start time of query
     :param queryEnd: End time of query
+    :param chunkMinutes: When given, the raw history is streamed in chunks of this many
+        minutes and counted in memory instead of running a CountOn calculation.
+    :param backend: 'tag' for queryTagCalculations, 'sql' to count in the historian database.
+    :param stateIndex: Interval index of the tag (stateIntervals.fetchIndex); answers without a historian call.
     :return: Result of the CountOn query
     """
     try:
         start = queryStart
         end = queryEnd
+        if stateIndex is not None:
+            return PerformanceTracking.v4.stateIntervals.countOn(stateIndex, start, end)
+        if backend == 'sql':
+            return PerformanceTracking.v4.historianSQL.getStateCalculations([tagPath], start, end)[tagPath][0]
+        if chunkMinutes:
+            samples = PerformanceTracking.v4.historian.iterHistory(tagPath, start, end, chunkMinutes)
+            return PerformanceTracking.v4.historian.accumulateOnState(samples, start, end)[0]
         paths = [tagPath]
-        countResult = system.tag.queryTagCalculations(paths, ["CountOn"], start, end)
+        countResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["CountOn"], start, end)
         return int(countResult.getValueAt(0, 1))
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in countOn: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.countOn', 'Error2': 'Error performing CountOn query', 'Error3': str(e)})
 
-def durationOn(tagPath, queryStart, queryEnd):
+def durationOn(tagPath, queryStart, queryEnd, chunkMinutes=None, backend='tag', stateIndex=None):
     """
     Performs a DurationOn query for a specified tag over a shift.
 
     :param tagPath: Path of the tag
     :param queryStart: Start time of query
+    :param chunkMinutes: When given, the raw history is streamed in chunks of this many
+        minutes and summed in memory instead of running a DurationOn calculation.
+    :param backend: 'tag' for queryTagCalculations, 'sql' to sum in the historian database.
+    :param stateIndex: Interval index of the tag (stateIntervals.fetchIndex); answers without a historian call.
     :return: Result of the DurationOn query or 0 if None
     """
     try:
         start = queryStart
         end = queryEnd
+        if stateIndex is not None:
+            return PerformanceTracking.v4.stateIntervals.durationOn(stateIndex, start, end)
+        if backend == 'sql':
+            return PerformanceTracking.v4.historianSQL.getStateCalculations([tagPath], start, end)[tagPath][1]
+        if chunkMinutes:
+            samples = PerformanceTracking.v4.historian.iterHistory(tagPath, start, end, chunkMinutes)
+            return PerformanceTracking.v4.historian.accumulateOnState(samples, start, end)[1]
         paths = [tagPath]
-        durationResult = system.tag.queryTagCalculations(paths, ["DurationOn"], start, end)
+        durationResult = PerformanceTracking.v4.historian.queryTagCalculations(paths, ["DurationOn"], start, end)
         return durationResult.getValueAt(0, 1) if durationResult is not None else 0
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
@@ -161,24 +183,395 @@ def getActiveRecipes(tagPath, machineName, activeRecipes):
         logger.error("ScriptError in getActiveRecipes: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getActiveRecipes', 'Error2': 'Error retrieving active recipes', 'Error3': str(e)})
 
-def main(systemNames, shiftStartHours):
+def getBatchedRecipeHistory(machinesBySystem, queryStart, queryEnd):
+    """
+    Fetches the Active Recipe history of every machine in one historian call.
+
+    :param machinesBySystem: List of (systemName, machineNames) pairs covered by the batch.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :return: Dictionary of (systemName, machineName) -> recipe history dataset
+    """
+    try:
+        recipePaths = []
+        machineKeys = []
+        for systemName, machineNames in machinesBySystem:
+            for machineName in machineNames:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                recipePaths.append(rootTagPath + 'Active Recipe')
+                machineKeys.append((systemName, machineName))
+
+        historyByPath = PerformanceTracking.v4.getRecipeRunInfo.getRecipeHistoryForMachines(queryStart, queryEnd, recipePaths) or {}
+        return dict((machineKeys[i], historyByPath.get(recipePaths[i])) for i in range(len(recipePaths)))
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getBatchedRecipeHistory: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getBatchedRecipeHistory', 'Error2': 'Error retrieving batched recipe history', 'Error3': str(e)})
+
+def getMachineStates(machinesBySystem, queryStart, queryEnd):
+    """
+    Reads the Cycle Done, In Cycle and Machine Idle history of every machine with one
+    Tall history query (historian.queryHistoryByPath), or from the historian query plan
+    active on this thread. Each machine's states are built from its own rows.
+
+    :param machinesBySystem: List of (systemName, machineNames) pairs.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :return: Dictionary of (systemName, machineName) -> {signal: (intervals, edges)}, as stateIntervals.getOnIntervals fills them
+    """
+    try:
+        machineTagPaths = []
+        paths = []
+        for systemName, machineNames in machinesBySystem:
+            for machineName in machineNames:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                tagPaths = createTagPaths(rootTagPath, machineName)
+                machineTagPaths.append(((systemName, machineName), tagPaths))
+                paths.extend([tagPaths['cycleDone'], tagPaths['idle'], tagPaths['inCycle']])
+
+        planner = PerformanceTracking.v4.historianPlanner
+        plan = planner.getActivePlan()
+        if plan is not None:
+            historyByPath = dict((tagPath, planner.getHistory(plan, tagPath, queryStart, queryEnd)) for tagPath in paths)
+        else:
+            historyByPath = PerformanceTracking.v4.historian.queryHistoryByPath(paths, queryStart, queryEnd) or {}
+
+        states = {}
+        for machineKey, tagPaths in machineTagPaths:
+            signals = {}
+            for signal in ('cycleDone', 'idle', 'inCycle'):
+                history = historyByPath.get(tagPaths[signal])
+                samples = [(history.getValueAt(row, 0), history.getValueAt(row, 1)) for row in range(history.getRowCount())] if history is not None else []
+                edges = []
+                signals[signal] = (PerformanceTracking.v4.stateIntervals.getOnIntervals(samples, queryStart, queryEnd, edges), edges)
+            states[machineKey] = signals
+        return states
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getMachineStates: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getMachineStates', 'Error2': 'Error reading machine states', 'Error3': str(e)})
+
+def calculateFromStates(signals, queryStart, queryEnd):
+    """
+    Computes the shift calculations of a machine from its state intervals in one pass,
+    including its explicit downtime: the time neither In Cycle nor Machine Idle was on.
+
+    :param signals: Dictionary of signal -> (intervals, edges) for cycleDone, idle and inCycle
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :return: Dictionary with 'partsComplete', 'idleSeconds', 'runSeconds', 'downSeconds',
+        'downIntervals' ((startMillis, endMillis) pairs), and 'idleIndex' and 'cycleIndex'
+        (stateIntervals.buildIndex of Machine Idle and Cycle Done)
+    """
+    stateIntervals = PerformanceTracking.v4.stateIntervals
+    downIntervals = []
+    shift = stateIntervals.clipToWindows(signals, [('shift', queryStart.getTime(), queryEnd.getTime())], ('down', ['inCycle', 'idle']), downIntervals)['shift']
+    return {
+        'partsComplete': shift['cycleDone']['countOn'],
+        'idleSeconds': shift['idle']['durationOn'] / 1000.0,
+        'runSeconds': shift['inCycle']['durationOn'] / 1000.0,
+        'downSeconds': shift['down']['durationOn'] / 1000.0,
+        'downIntervals': downIntervals,
+        'idleIndex': stateIntervals.buildIndex(signals['idle'][0], signals['idle'][1], queryStart, queryEnd),
+        'cycleIndex': stateIntervals.buildIndex(signals['cycleDone'][0], signals['cycleDone'][1], queryStart, queryEnd)
+    }
+
+def getMachineCalculations(machinesBySystem, queryStart, queryEnd, incremental=False, readStates=False, reconcileMinutes=None):
+    """
+    Runs the shift CountOn/DurationOn calculations of every machine in one historian call
+    (historian.queryCalculationsByPath), so the historian computes them server-side.
+    Downtime is the time left after idle and run time.
+
+    :param machinesBySystem: List of (systemName, machineNames) pairs.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :param incremental: When True, shift-to-date accumulators only read the history
+        since the previous cycle (see shiftAccumulators.advance) instead.
+    :param reconcileMinutes: In incremental mode, the trailing window the accumulators
+        read again so history that arrived late amends the shift totals.
+    :param readStates: When True and not incremental, the raw states of every machine are
+        read instead (getMachineStates), so the calculations also carry the downtime
+        intervals and the Machine Idle and Cycle Done indexes that the recipe runs and
+        cycle time sketches reuse. That read grows with the length of the shift.
+    :return: Dictionary of (systemName, machineName) -> calculations, as calculateFromStates returns them
+    """
+    try:
+        if readStates and not incremental:
+            states = getMachineStates(machinesBySystem, queryStart, queryEnd)
+            return dict((machineKey, calculateFromStates(signals, queryStart, queryEnd)) for machineKey, signals in states.items())
+
+        machineTagPaths = []
+        paths = []
+        for systemName, machineNames in machinesBySystem:
+            for machineName in machineNames:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                tagPaths = createTagPaths(rootTagPath, machineName)
+                machineTagPaths.append(((systemName, machineName), tagPaths))
+                paths.extend([tagPaths['cycleDone'], tagPaths['idle'], tagPaths['inCycle']])
+
+        if incremental:
+            accumulated = PerformanceTracking.v4.shiftAccumulators.advance(paths, queryStart, queryEnd, reconcileMinutes)
+        else:
+            results = PerformanceTracking.v4.historian.queryCalculationsByPath(paths, ["CountOn", "DurationOn"], queryStart, queryEnd)
+            accumulated = dict((path, (int(results[path]["CountOn"] or 0), results[path]["DurationOn"] or 0)) for path in paths)
+        elapsedSeconds = (queryEnd.getTime() - queryStart.getTime()) / 1000.0
+        calculations = {}
+        for machineKey, tagPaths in machineTagPaths:
+            idleSeconds = accumulated[tagPaths['idle']][1]
+            runSeconds = accumulated[tagPaths['inCycle']][1]
+            calculations[machineKey] = {
+                'partsComplete': accumulated[tagPaths['cycleDone']][0],
+                'idleSeconds': idleSeconds,
+                'runSeconds': runSeconds,
+                'downSeconds': max(0.0, elapsedSeconds - idleSeconds - runSeconds)
+            }
+        return calculations
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getMachineCalculations: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getMachineCalculations', 'Error2': 'Error running batched machine calculations', 'Error3': str(e)})
+
+def planCycleQueries(machinesBySystem, queryStart, queryEnd, recipeStart=None, includeStates=True):
+    """
+    Collects the historian requests of one update cycle up front and executes them with
+    as few historian calls as possible: the Cycle Done, In Cycle, Machine Idle and Active
+    Recipe history of every machine.
+
+    :param machinesBySystem: List of (systemName, machineNames) pairs.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :param recipeStart: Start of the Active Recipe history; queryStart when omitted.
+    :param includeStates: Request the state histories; incremental cycles use the shift
+        accumulators instead.
+    :return: Tuple of (plan, dictionary of (systemName, machineName) -> recipe history dataset)
+    """
+    try:
+        planner = PerformanceTracking.v4.historianPlanner
+        plan = planner.newPlan()
+        recipeStart = recipeStart or queryStart
+        machineTagPaths = []
+        for systemName, machineNames in machinesBySystem:
+            for machineName in machineNames:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                tagPaths = createTagPaths(rootTagPath, machineName)
+                machineTagPaths.append(((systemName, machineName), tagPaths))
+                if includeStates:
+                    for signal in ('cycleDone', 'idle', 'inCycle'):
+                        planner.requestHistory(plan, tagPaths[signal], queryStart, queryEnd)
+                planner.requestHistory(plan, tagPaths['activeRecipe'], recipeStart, queryEnd)
+        planner.execute(plan)
+
+        recipeHistory = {}
+        for machineKey, tagPaths in machineTagPaths:
+            recipeHistory[machineKey] = planner.getHistory(plan, tagPaths['activeRecipe'], recipeStart, queryEnd)
+
+        return plan, recipeHistory
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in planCycleQueries: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.planCycleQueries', 'Error2': 'Error planning historian queries', 'Error3': str(e)})
+
+def getBufferedSamples(machinesBySystem, queryStart, queryEnd):
+    """
+    Reads the machines whose transition buffer covers the window from that buffer.
+
+    :param machinesBySystem: List of (systemName, machineNames) pairs.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :return: Dictionary of (systemName, machineName) -> {signal: samples}, for covered machines only
+    """
+    try:
+        bufferedSamples = {}
+        for systemName, machineNames in machinesBySystem:
+            for machineName in machineNames:
+                rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+                samples = PerformanceTracking.v4.transitionBuffer.getMachineSamples(rootTagPath, queryStart, queryEnd)
+                if samples is not None:
+                    bufferedSamples[(systemName, machineName)] = samples
+        return bufferedSamples
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getBufferedSamples: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getBufferedSamples', 'Error2': 'Error reading transition buffers', 'Error3': str(e)})
+
+def calculateFromSamples(samples, queryStart, queryEnd):
+    """
+    Computes the shift calculations of a machine from its buffered transitions.
+
+    :param samples: Dictionary of signal -> samples, as getBufferedSamples returns them
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :return: Dictionary of calculations, as calculateFromStates returns it
+    """
+    signals = {}
+    for signal in ('cycleDone', 'idle', 'inCycle'):
+        edges = []
+        signals[signal] = (PerformanceTracking.v4.stateIntervals.getOnIntervals(samples[signal], queryStart, queryEnd, edges), edges)
+    return calculateFromStates(signals, queryStart, queryEnd)
+
+def getMachineBreakdown(systemName, machineName, queryStart, queryEnd, recipeRunData=None, bucketMinutes=60):
+    """
+    Breaks the Cycle Done, In Cycle and Machine Idle states of a machine, and the downtime
+    left between them, down by shift, time bucket and recipe run in one pass (see
+    stateIntervals.clipToWindows). The states
+    come from the machine's transitionBuffer when it covers the window, otherwise from
+    one history read per tag.
+
+    :param systemName: The name of the system.
+    :param machineName: The name of the machine.
+    :param queryStart: Start time of query
+    :param queryEnd: End time of query
+    :param recipeRunData: Recipe runs of the window, as getRecipeRunInfo.main returns them;
+        compiled from the Active Recipe history when omitted.
+    :param bucketMinutes: Width of the time buckets in minutes.
+    :return: Dictionary with 'shift' (signal -> {'durationOn' ms, 'countOn'}), 'buckets'
+        (list of (bucket start, results)), 'runs' (list of (recipe, results) in run order)
+        and 'downIntervals' ((startMillis, endMillis) pairs)
+    """
+    try:
+        stateIntervals = PerformanceTracking.v4.stateIntervals
+        rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
+        tagPaths = createTagPaths(rootTagPath, machineName)
+        buffered = PerformanceTracking.v4.transitionBuffer.getMachineSamples(rootTagPath, queryStart, queryEnd)
+
+        signals = {}
+        for signal in ('cycleDone', 'inCycle', 'idle'):
+            samples = buffered[signal] if buffered is not None else stateIntervals.fetchSamples(tagPaths[signal], queryStart, queryEnd)
+            edges = []
+            signals[signal] = (stateIntervals.getOnIntervals(samples, queryStart, queryEnd, edges), edges)
+
+        if recipeRunData is None:
+            recipeHistory = PerformanceTracking.v4.transitionBuffer.toRecipeHistory(buffered['activeRecipe']) if buffered is not None else None
+            recipeRunData = PerformanceTracking.v4.getRecipeRunInfo.getRecipeRunsFromHistorian(queryStart, queryEnd, tagPaths['activeRecipe'], recipeHistory)
+
+        dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+        runs = []
+        windows = [('shift', queryStart.getTime(), queryEnd.getTime())]
+        windows.extend(stateIntervals.bucketWindows(queryStart, queryEnd, bucketMinutes))
+        for row in range(recipeRunData.getRowCount()):
+            runStart = dateFormat.parse(recipeRunData.getValueAt(row, "Start Time")).getTime()
+            runEnd = dateFormat.parse(recipeRunData.getValueAt(row, "End Time")).getTime()
+            windows.append((('run', row), runStart, runEnd))
+            runs.append(recipeRunData.getValueAt(row, "Recipe Name"))
+
+        downIntervals = []
+        results = stateIntervals.clipToWindows(signals, windows, ('down', ['inCycle', 'idle']), downIntervals)
+        return {
+            'shift': results['shift'],
+            'downIntervals': downIntervals,
+            'buckets': [(Date(key[1]), results[key]) for key, windowStart, windowEnd in windows if key[0] == 'bucket'],
+            'runs': [(runs[row], results[('run', row)]) for row in range(len(runs))]
+        }
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in getMachineBreakdown: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.getMachineBreakdown', 'Error2': 'Error breaking down machine states', 'Error3': str(e)})
+
+def observeCycleTimes(rootTagPath, cycleEdges, recipeRunData, shiftStart, idleIntervals=None, downIntervals=None):
+    """
+    Feeds the Cycle Done edges of a machine into its per-recipe cycle time sketches.
+
+    :param rootTagPath: Root tag path of the machine.
+    :param cycleEdges: Cycle Done rising edges in epoch milliseconds.
+    :param recipeRunData: Recipe runs of the shift, as getRecipeRunInfo.main returns them.
+    :param shiftStart: Start of the current shift.
+    :param idleIntervals: (startMillis, endMillis) idle intervals no cycle may span.
+    :param downIntervals: (startMillis, endMillis) down intervals; only stops longer than a few cycle targets split a cycle.
+    """
+    try:
+        dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss.SSS")
+        recipeRuns = []
+        for row in range(recipeRunData.getRowCount()):
+            runStart = dateFormat.parse(recipeRunData.getValueAt(row, "Start Time")).getTime()
+            runEnd = dateFormat.parse(recipeRunData.getValueAt(row, "End Time")).getTime()
+            recipeRuns.append((recipeRunData.getValueAt(row, "Recipe Name"), runStart, runEnd, recipeRunData.getValueAt(row, "Cycle Target")))
+        PerformanceTracking.v4.cycleTimeSketch.observe(rootTagPath, cycleEdges, recipeRuns, shiftStart, idleIntervals, downIntervals)
+    except Exception as e:
+        logger = system.util.getLogger("Exception_Error")
+        logger.error("ScriptError in observeCycleTimes: " + str(e))
+        system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.observeCycleTimes', 'Error2': 'Error observing cycle times', 'Error3': str(e)})
+
+def main(systemNames, shiftStartHours, batchScope=None, incremental=False, transitionsOnly=False, reconcileMinutes=None, planQueries=False, readStates=False):
     """
     Queries tag history for multiple systems and performs data aggregation on Historical Tag Paths.
 
     Args:
         systemNames: A list of system names to query.
         shiftStartHours: List of hours at which the shift starts.
+        batchScope: None to query the Active Recipe history machine by machine,
+            'system' to fetch it once per system or 'plant' to fetch it once for all systems.
+        incremental: When True, recipe runs before each machine's watermark are read from
+            the RecipeRunData store instead of the historian, and the shift calculations
+            only add what happened since the previous cycle.
+        transitionsOnly: When True and batchScope is None, only the raw Active Recipe
+            changes are retrieved from the historian.
+        reconcileMinutes: In incremental mode, the trailing window behind each watermark
+            that is re-examined for history that arrived late. The shift totals re-read
+            the same trailing window.
+        planQueries: When True, the historian requests of the whole cycle are collected
+            and merged up front (see planCycleQueries); batchScope is then ignored.
+        readStates: When True, the shift calculations come from the raw states of every
+            machine instead of historian calculations, and the same read also serves the
+            idle time and actual parts of the recipe runs and the cycle time sketches.
+
+    Machines whose transitionBuffer covers the shift are calculated from it, without
+    historian queries.
     """
     try:
-        for systemName in systemNames:
-            # Find all child machines for a given system name, excluding system tags
-            machineNames = findChildMachines(systemName)            
+        # Find all child machines for each system name, excluding system tags
+        machinesBySystem = [(systemName, findChildMachines(systemName)) for systemName in systemNames]
 
-            # Define the end time for the query as the current time
-            end = system.date.now()
-            # Calculate the start time of the current shift
-            shiftStartTime = Utility.getCurrentShiftStart(shiftStartHours)
+        # Define the end time for the query as the current time
+        end = system.date.now()
+        # Calculate the start time of the current shift
+        shiftStartTime = Utility.getCurrentShiftStart(shiftStartHours)
 
+        # Machines whose transition buffer covers the shift need no historian queries
+        bufferedSamples = getBufferedSamples(machinesBySystem, shiftStartTime, end) or {}
+        historianMachines = [(systemName, [machineName for machineName in machineNames if (systemName, machineName) not in bufferedSamples]) for systemName, machineNames in machinesBySystem]
+
+        # Cached history of the reconciliation windows would hide the late samples
+        if incremental and reconcileMinutes:
+            machineKeys = [(systemName, machineName) for systemName, machineNames in machinesBySystem for machineName in machineNames]
+            PerformanceTracking.v4.getRecipeRunInfo.invalidateReconcileWindows(machineKeys, shiftStartTime, end, reconcileMinutes)
+
+        # Incremental runs only read the Active Recipe history after each machine's
+        # watermark, so a batched history starts at the earliest one
+        recipeStart = shiftStartTime
+        if incremental and (planQueries or batchScope is not None):
+            machineKeys = [(systemName, machineName) for systemName, machineNames in historianMachines for machineName in machineNames]
+            recipeStart = PerformanceTracking.v4.getRecipeRunInfo.getIncrementalHistoryStart(machineKeys, shiftStartTime, end, reconcileMinutes)
+
+        plan = None
+        recipeHistory = None
+        if planQueries:
+            plan, recipeHistory = planCycleQueries(historianMachines, shiftStartTime, end, recipeStart, includeStates=readStates and not incremental)
+            PerformanceTracking.v4.historianPlanner.activate(plan)
+        elif batchScope == 'plant':
+            recipeHistory = getBatchedRecipeHistory(historianMachines, recipeStart, end)
+        elif batchScope == 'system':
+            recipeHistory = {}
+            for machines in historianMachines:
+                recipeHistory.update(getBatchedRecipeHistory([machines], recipeStart, end) or {})
+        # Shift calculations of every machine from one batched call (state reads are served by the plan when active)
+        machineCalculations = getMachineCalculations(historianMachines, shiftStartTime, end, incremental, readStates, reconcileMinutes)
+
+        # Buffered machines are calculated from their transition buffer instead
+        machineRecipeHistories = dict(recipeHistory or {})
+        for machine, buffered in bufferedSamples.items():
+            machineCalculations[machine] = calculateFromSamples(buffered, shiftStartTime, end)
+            machineRecipeHistories[machine] = PerformanceTracking.v4.transitionBuffer.toRecipeHistory(buffered['activeRecipe'])
+
+        # Recipe runs of every machine on the v4 path, with the recipe targets joined in one pass.
+        # With readStates, the state read behind the shift calculations serves the idle time and actual parts of every run
+        recipeRunsByMachine = {}
+        if not incremental:
+            batchMachines = [(systemName, machineName) for systemName, machineNames in machinesBySystem for machineName in machineNames if (systemName, machineName) in bufferedSamples or recipeHistory is not None or transitionsOnly]
+            stateIndexes = dict((machine, (machineCalculations[machine].get('idleIndex'), machineCalculations[machine].get('cycleIndex'))) for machine in batchMachines)
+            if batchMachines:
+                recipeRunsByMachine = PerformanceTracking.v4.getRecipeRunInfo.mainForMachines(batchMachines, shiftStartTime, end, machineRecipeHistories, transitionsOnly, stateIndexes) or {}
+
+        for systemName, machineNames in machinesBySystem:
             for machineName in machineNames:
                 # Construct the root tag path for each machine
                 rootTagPath = "[SCADA Overview]Performance Tracking/" + systemName + "/" + machineName + '/'
@@ -190,22 +583,32 @@ def main(systemNames, shiftStartHours):
                 queryEnd = end
 
                 # Get recipe run information for the machine within the shift period
-                recipeRunData = PerformanceTracking.v3.getRecipeRunInfo.main(systemName, machineName, queryStart, queryEnd)
+                calculations = machineCalculations[(systemName, machineName)]
+                if incremental:
+                    recipeRunData = PerformanceTracking.v4.getRecipeRunInfo.incrementalMain(systemName, machineName, queryStart, queryEnd, machineRecipeHistories.get((systemName, machineName)), transitionsOnly, reconcileMinutes)
+                elif (systemName, machineName) in recipeRunsByMachine:
+                    recipeRunData = recipeRunsByMachine[(systemName, machineName)]
+                else:
+                    recipeRunData = PerformanceTracking.v3.getRecipeRunInfo.main(systemName, machineName, queryStart, queryEnd)
 
                 # Calculate the total expected parts from the recipe run data
-                expectedPartsIndex = recipeRunData.getColumnIndex("Expected Parts")
-                totalExpectedParts = sum(recipeRunData.getValueAt(row, expectedPartsIndex) for row in range(recipeRunData.getRowCount()))
+                totalExpectedParts = PerformanceTracking.v4.datasetColumns.columnSum(recipeRunData, "Expected Parts")
+
+                # Cycle times per recipe, from the same Cycle Done edges
+                if calculations.get('cycleIndex') is not None:
+                    # Gaps spent idle or stopped are not cycle times
+                    idleIndex = calculations['idleIndex']
+                    idleIntervals = zip(idleIndex['starts'], idleIndex['ends'])
+                    observeCycleTimes(rootTagPath, calculations['cycleIndex']['edges'], recipeRunData, shiftStartTime, idleIntervals, calculations['downIntervals'])
 
                 # Count completed parts within the shift
-                partsComplete = countOn(tagPaths['cycleDone'], queryStart, queryEnd)
+                partsComplete = calculations['partsComplete']
                 # Calculate idle time in minutes for the shift
-                shiftIdleTime = round(durationOn(tagPaths['idle'], queryStart, queryEnd) / 60.0, 2)
+                shiftIdleTime = round(calculations['idleSeconds'] / 60.0, 2)
                 # Calculate run time in minutes for the shift
-                shiftRunTime = round(durationOn(tagPaths['inCycle'], queryStart, queryEnd) / 60.0, 2)
-                # Calculate total time in minutes from shift start to current time
-                timeDifferenceInMinutes = round((end.getTime() - shiftStartTime.getTime()) / 60000.0, 2)
-                # Determine downtime by subtracting idle and run time from total time
-                shiftDownTime = timeDifferenceInMinutes - shiftIdleTime - shiftRunTime
+                shiftRunTime = round(calculations['runSeconds'] / 60.0, 2)
+                # Downtime is the time neither In Cycle nor Machine Idle was on
+                shiftDownTime = round(calculations['downSeconds'] / 60.0, 2)
                 # Aggregate data to be written to system tags
                 dataToWrite = {
                     'shiftRunTime': shiftRunTime,
@@ -222,11 +625,17 @@ def main(systemNames, shiftStartHours):
                 getActiveRecipes(tagPaths['activeRecipe'], machineName, activeRecipes)
             
             #PerformanceTracking.v3.updateSystemScore.main(startTime, endTime, systemName)
+
+        if plan is not None:
+            stats = PerformanceTracking.v4.historianPlanner.getStats(plan)
+            system.util.getLogger("PerformanceTracking").info("Historian plan served %d requests with %d calls (%d saved)" % (stats['requested'], stats['backendCalls'], stats['saved']))
                 
     except Exception as e:
         logger = system.util.getLogger("Exception_Error")
         logger.error("ScriptError in main: " + str(e))
         system.db.runNamedQuery('Exception_Error/Exception', {'Error1': 'SCADAOVERVIEW/updateMachineInfo.main', 'Error2': 'Error in main function', 'Error3': str(e)})
+    finally:
+        PerformanceTracking.v4.historianPlanner.deactivate()
         
         
 def diagnostic(systemNames, shiftStartHours):
@@ -282,8 +691,7 @@ def diagnostic(systemNames, shiftStartHours):
             PerformanceTracking.v4.upsertRecipeRunDB.main(recipeRunData, systemName, machineName)
 
             # Calculate the total expected parts from the recipe run data
-            expectedPartsIndex = recipeRunData.getColumnIndex("Expected Parts")
-            totalExpectedParts = sum(recipeRunData.getValueAt(row, expectedPartsIndex) for row in range(recipeRunData.getRowCount()))
+            totalExpectedParts = PerformanceTracking.v4.datasetColumns.columnSum(recipeRunData, "Expected Parts")
             print("Total expected parts: {}".format(totalExpectedParts))
 
             # Count completed parts within the shift
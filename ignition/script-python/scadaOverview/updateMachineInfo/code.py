@@ -21,8 +21,10 @@ def getShiftData(start, end, tagPath):
     Returns:
         dataset: A dataset with processed shift recipe runs.
     """
-    queryStart = system.date.addHours(start, -1)
-    rawDataSet = system.tag.queryTagHistory(paths=[tagPath], startDate=queryStart, endDate=end, returnSize=-1, aggregationMode="Maximum", returnFormat='Wide')
+    queryStart = start
+    # The recipe active at shift start comes from the bounding value instead of an hour of padding
+    rawDataSet = PerformanceTracking.v4.historian.queryTagHistory(paths=[tagPath], startDate=queryStart, endDate=end, returnSize=-1, aggregationMode="Maximum", includeBoundingValues=True, returnFormat='Wide')
+    rawDataSet = PerformanceTracking.v4.historian.clampHistory(rawDataSet, start, end)
 
     uniqueDataSet = getUniqueRecipes(rawDataSet)
 